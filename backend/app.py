@@ -1,37 +1,74 @@
 #app.py
+import time
+# Start of the cold-start clock: import -> first response is checked against COLD_START_BUDGET_MS
+APP_IMPORT_STARTED = time.perf_counter()
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-import re, os, json, aiohttp, random
+from typing import List
+import re, os, json, aiohttp, random, asyncio, hashlib
 from urllib.parse import urlparse, parse_qs
-from openai import OpenAI
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+# Before any component import: components read their settings (LOG_LEVEL,
+# DEBUG_DUMP_IDS, HTTP_POOL_LIMIT_PER_HOST, ...) from the environment at import time
+load_dotenv()
 from components.YouTube_request import search_similar_videos
 
-# Initialize Firebase Admin SDK
-# cred = credentials.Certificate("serviceAccountKey.json")
-
-service_account_info = json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT"])
-cred = credentials.Certificate(service_account_info)
-firebase_admin.initialize_app(cred)
-
+# Firebase is initialized on first use (or in the lifespan hook) by components/Clients.py,
+# from the FIREBASE_SERVICE_ACCOUNT environment variable
+from components.Clients import warm_up, init_timings
+from components.Metrics import metrics, span, count, start_trace, end_trace, log_trace
+from components.Logger import get_logger, bind, debug_dump, new_request_id
 from components.OpenAI_request import ChatApp
-from components.Database import db, create_session, store_messages, get_recent_messages
-from components.YouTube_request import search_similar_videos, get_search_response, get_video_info, info_to_dict, extract_video_id, get_video_thumbnail, check_resource_availability, get_video_stats
+from components.LLM_engine import LLMEngine
+from components.Partial_json import PartialJSONAssembler
+from components.Plan_templates import plan_templates
+from components.Jobs import job_runner, public_view, JOB_RUN_BUDGET_SECONDS
+from components.Study_plan import parse_study_plan
+from components.Response_cache import response_cache, plan_reasoning_cache, topic_cache, RESPONSE_CACHE_ENABLED
+from components import Prompts
+from components.Database import create_session, store_messages, get_recent_messages, ParticipantSession, history_writer
+from components.YouTube_request import key_pool, VIDEO_BATCH_SIZE, search_similar_videos, search_similar_candidates, get_search_response, get_video_info, info_to_dict, extract_video_id, get_video_thumbnail, check_resource_availability, get_video_stats
 from components.GoogleSearch_request import google_search_availability
+from components.API_key_pool import QUOTA_COST, error_reason
+from components.Video_cache import video_cache
+from components.HTTP_client import open_session, close_session, get_session, YOUTUBE_VIDEOS_URL
 
-
-from dotenv import load_dotenv
-load_dotenv()
+logger = get_logger("app")
 youtube_api_keys = [k for k in os.environ if k.startswith("YOUTUBE_API_KEY")]
 YOUTUBE_URL_PATTERN = re.compile(r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$")
 
 api_key = os.getenv('API_KEY1')
-client = OpenAI(api_key=api_key)
+# Shared async LLM layer; LLM_MAX_CONCURRENCY bounds in-flight generations per worker
+llm = LLMEngine(api_key=api_key, response_cache=response_cache if RESPONSE_CACHE_ENABLED else None)
+
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "3000"))
+startup_timings = {"import_ms": round((time.perf_counter() - APP_IMPORT_STARTED) * 1000, 1)}
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create Firestore once here when the platform runs lifespan hooks; otherwise on first use
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        logger.warning(f"Client warm-up failed, clients will be created on first use: {e}")
+    startup_timings["warm_up_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    # One pooled HTTP session for the lifetime of the worker
+    await open_session()
+    # Write-behind history persistence; flushed on shutdown
+    await history_writer.start()
+    # Pick up jobs whose worker went away mid-run
+    run_in_background(job_runner.resume_stale())
+    yield
+    await job_runner.stop()
+    await history_writer.stop()
+    await close_session()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -40,7 +77,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-chat_app = ChatApp(api_key=api_key)
+chat_app = ChatApp(llm=llm)
+
+@app.middleware("http")
+async def record_first_response(request: Request, call_next):
+    response = await call_next(request)
+    if "first_response_ms" not in startup_timings:
+        elapsed = round((time.perf_counter() - APP_IMPORT_STARTED) * 1000, 1)
+        startup_timings["first_response_ms"] = elapsed
+        startup_timings["first_path"] = request.url.path
+        if elapsed > COLD_START_BUDGET_MS:
+            logger.warning(f"Cold start over budget: {elapsed} ms to first response (budget {COLD_START_BUDGET_MS} ms)")
+    return response
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Spans and counters recorded while serving the request end up in one structured log line.
+    # Streaming endpoints return once headers are sent; work after that is only in /metrics.
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    bind(request_id=request_id)
+    trace, token = start_trace(request.url.path)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        end_trace(token)
+        # Keyed on the route template (/jobs/{job_id}) so IDs and 404 probes do not each get a series
+        trace.name = route_name(request)
+        metrics.record(f"http.{request.method} {trace.name}", (time.perf_counter() - trace.started) * 1000, error=status >= 500)
+        if trace.spans or trace.counters:
+            log_trace(trace, method=request.method, status=status, path=request.url.path)
+
+def route_name(request: Request) -> str:
+    # The router records the matched route in the scope; requests that matched none share one bucket
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+@app.get("/metrics")
+async def get_metrics():
+    # Latency percentiles per span (http, llm, youtube, firestore, videos) and running counters
+    return metrics.snapshot()
+
+@app.get("/startup")
+async def get_startup_timings():
+    # Import, warm-up and import-to-first-response times, plus per-client creation times
+    return {**startup_timings, "budget_ms": COLD_START_BUDGET_MS, "clients_ms": init_timings}
 
 @app.get('/')
 def hello_world():
@@ -49,9 +133,13 @@ def hello_world():
 class MessageRequest(BaseModel):
     user_message: str = None
     participantId: str
+    stream: bool = False
+    # Run as a background job and return its ID instead of the response
+    background: bool = False
 
 class InfoRequest(BaseModel):
     info_message: str
+    stream: bool = False
 
 class SearchRequest(BaseModel):
     search_message: str
@@ -75,359 +163,672 @@ class UserMessageRequest(BaseModel):
     user_message: str
     participantId: str
 
+class BulkTopicsRequest(BaseModel):
+    participantId: str
+    topics: List[str] = None  # None: every topic in the current plan
+    kinds: List[str] = ["explanations", "objectives"]
+
 @app.post("/response")
 async def generate_response(request: MessageRequest):
-    try:
-        # Database
-        participantId = request.participantId
-        session_ref = db.collection("messages").document(participantId)
-        if not session_ref.get().exists:
-            create_session(participantId)
-            print("Session created for", participantId)
-        else:
-            print("Session already exists for", participantId)
-
-        user_chat = None
-        # Separate user_message and user_chat
-        user_message = request.user_message
-        if user_message and user_message.startswith("Create a study plan for a"):
-            # Treat as user_message
-            print("Detected as user_message:", user_message)
-        else: 
-            user_chat = user_message
-
-        # If chatting,
-        if user_chat:
-            print("Chatting")
-            session_ref.set({"user_input": user_chat}, merge=True)
-            response_chat = chat_app.chat_response(user_chat, participantId)
-            if not response_chat:
-                raise HTTPException(status_code=500, detail="Failed to generate improved response")
-                
-            # Process the improved response to check and replace invalid YouTube videos
-            updated_improved_response = await process_improved_response(user_chat, response_chat)
-
-            # Store the updated improved response
-            
-            store_messages(participantId, user_chat, updated_improved_response)
-            print("Stored improved response with valid YouTube video IDs")
-            print(updated_improved_response)
-            return {"response": updated_improved_response}
-        
-        if not user_message:
+    if request.background:
+        if not request.user_message:
             raise HTTPException(status_code=400, detail="No message provided")
-        
-        print("Submitted")
-        # Step 1
-        # Generate response and store it
-        response_text = chat_app.chat(user_message)
-        if not response_text:
-            raise HTTPException(status_code=500, detail="No response received from OpenAI")
-        
-        # Store the message and response in Firestore (append to history)
-        store_messages(participantId, user_message, response_text)
-        session_ref.set({"user_message": user_message}, merge=True)
-        print("Stored initial response")
+        return await submit_job("response", request.participantId, request.user_message)
 
-        return {"response": response_text}
+    if request.stream:
+        if not request.user_message:
+            raise HTTPException(status_code=400, detail="No message provided")
+
+        async def run_response(emit):
+            response = await respond_to_message(request.participantId, request.user_message, emit)
+            emit("done", {"response": response})
+
+        return stream_events(run_response, "response")
+
+    try:
+        response = await respond_to_message(request.participantId, request.user_message)
+        return {"response": response}
 
     except Exception as e:
         # General error logging
-        print(f"Unexpected error occurred in /response endpoint: {e}")
+        logger.exception(f"Unexpected error occurred in /response endpoint: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate response")
 
+async def respond_to_message(participantId: str, user_message: str, emit=None, once=None):
+    # Shared by the plain and streaming /response and the response job; `emit` forwards
+    # tokens when streaming, `once` makes the history append idempotent (see ParticipantSession.commit)
+    # Database: one read of the participant document, one write at the end
+    bind(participant_id=participantId)
+    session = ParticipantSession(participantId)
+    await session.load()
+    if not session.exists:
+        session.create()
+        logger.info("Session created")
+    else:
+        logger.debug("Session already exists")
+
+    user_chat = None
+    # Separate user_message and user_chat
+    if user_message and user_message.startswith("Create a study plan for a"):
+        # Treat as user_message
+        logger.info("Detected plan request", extra={"user_message": user_message})
+    else: 
+        user_chat = user_message
+
+    # If chatting,
+    if user_chat:
+        logger.info("Chatting")
+        session.set_fields(user_input=user_chat)
+        on_token = token_emitter(emit, "chat", PartialJSONAssembler()) if emit else None
+        conversation_history = await session.history()
+        response_chat = await chat_app.chat_response(user_chat, participantId, on_token=on_token, conversation_history=conversation_history)
+        if not response_chat:
+            raise HTTPException(status_code=500, detail="Failed to generate improved response")
+            
+        # Process the improved response to check and replace invalid YouTube videos
+        updated_improved_response = await process_improved_response(user_chat, response_chat)
+
+        # Store the updated improved response
+        session.append_messages(user_chat, updated_improved_response)
+        await session.commit(once=once)
+        logger.info("Stored chat response")
+        debug_dump(logger, "Chat response", updated_improved_response)
+        return updated_improved_response
+    
+    if not user_message:
+        raise HTTPException(status_code=400, detail="No message provided")
+    
+    logger.info("Plan request submitted")
+    # Step 1
+    # Serve a precomputed plan for common requests, otherwise generate one
+    on_token = token_emitter(emit, "initial", PartialJSONAssembler()) if emit else None
+    response_text = await asyncio.to_thread(plan_templates.lookup, user_message)
+    if response_text:
+        logger.info("Served plan template")
+        chat_app.conversations.append(participantId, "user", user_message)
+        chat_app.conversations.append(participantId, "assistant", response_text)
+        if on_token:
+            on_token(response_text)
+    else:
+        response_text = await chat_app.chat(user_message, participantId, on_token=on_token)
+    if not response_text:
+        raise HTTPException(status_code=500, detail="No response received from OpenAI")
+    
+    # Store the message and response in Firestore (append to history)
+    session.append_messages(user_message, response_text)
+    session.set_fields(user_message=user_message)
+    await session.commit(once=once)
+    logger.info("Stored initial response")
+
+    return response_text
+
 
 @app.post("/response/critique")
 async def generate_critique_response(request: MessageRequest):
+    if request.background:
+        return await submit_job("critique", request.participantId)
     try:
-        participantId = request.participantId
-        initial_response = get_recent_messages(participantId)[-1]['content']  # Get the last message if stored
-
-        critique_response = chat_app.get_critique_response(initial_response)
-        if critique_response:
-            store_messages(participantId, "Critique of Initial Response", critique_response)
-            print("Stored critique response")
-
-        return {"response": critique_response}
+        return {"response": await critique_for(request.participantId)}
 
     except Exception as e:
-        print(f"Error in critique response: {e}")
+        logger.exception(f"Error in critique response: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate critique response")
 
+async def critique_for(participantId: str, once=None):
+    bind(participant_id=participantId)
+    session = ParticipantSession(participantId)
+    initial_response = (await session.recent_messages())[-1]['content']  # Get the last message if stored
+
+    critique_response = await chat_app.get_critique_response(initial_response)
+    if critique_response:
+        session.append_messages("Critique of Initial Response", critique_response)
+        await session.commit(once=once)
+        logger.info("Stored critique response")
+    return critique_response
+
 @app.post("/response/improved")
 async def generate_improved_response(request: MessageRequest):
+    if request.background:
+        return await submit_job("improved", request.participantId, request.user_message)
     try:
-        participantId = request.participantId
-        session_ref = db.collection("messages").document(participantId)
-        user_message = request.user_message or session_ref.get().to_dict().get("user_message")
-        print("USER MESSAGE in /response/improved", user_message)
+        return {"response": await improve_for(request.participantId, request.user_message)}
+
+    except TypeError as e:
+        logger.exception(f"TypeError in improved response: {e}")
+        raise HTTPException(status_code=500, detail="Type error encountered while generating improved response")
 
-        messages = get_recent_messages(participantId)
-        initial_response = messages[-2]['content']  
-        critique_response = messages[-1]['content']
+    except Exception as e:
+        logger.exception(f"Error in improved response: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate improved response")
+
+async def improve_for(participantId: str, user_message: str = None, once=None):
+    bind(participant_id=participantId)
+    session = ParticipantSession(participantId)
+    if not user_message:
+        await session.load()
+        user_message = session.get("user_message")
+    logger.debug("Improving plan", extra={"user_message": user_message})
+
+    messages = await session.recent_messages()
+    initial_response = messages[-2]['content']  
+    critique_response = messages[-1]['content']
+
+    improved_response = await chat_app.get_improved_response(user_message, initial_response, critique_response)
+    if not improved_response:
+        # Also runs in background jobs; the endpoint turns this into a 500
+        raise RuntimeError("Failed to generate improved response")
+        
+    # Process the improved response to check and replace invalid YouTube videos
+    updated_improved_response = await process_improved_response(user_message, improved_response)
+
+    # Store the updated improved response
+    session.append_messages("Improved Response", updated_improved_response)
+    track_plan(session, updated_improved_response)
+    await session.commit(once=once)
+    logger.info("Stored improved response with valid YouTube video IDs")
+    debug_dump(logger, "Improved response", updated_improved_response)
+    return updated_improved_response
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+background_tasks = set()
+SSE_KEEPALIVE_SECONDS = 15
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+    return task
+
+def finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task failed: {task.exception()}")
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_events(produce, name: str) -> StreamingResponse:
+    # Runs `produce(emit)` as its own task and streams whatever it emits as
+    # server-sent events. The task outlives the connection, so a dropped client
+    # does not abandon work already paid for.
+    queue = asyncio.Queue()
+
+    def emit(event, data):
+        queue.put_nowait(sse_event(event, data))
+
+    async def run():
+        try:
+            await produce(emit)
+        except Exception as e:
+            logger.exception(f"Error in {name} stream: {e}")
+            emit("error", {"detail": f"Failed to generate {name} response"})
+        finally:
+            queue.put_nowait(None)
+
+    run_in_background(run())
+
+    async def event_stream():
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield event
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def token_emitter(emit, stage: str, assembler=None):
+    # Forwards each token; with an assembler, also emits the partial plan as it grows
+    def on_token(token):
+        emit("token", {"stage": stage, "token": token})
+        if assembler is not None:
+            partial = assembler.feed(token)
+            if partial is not None:
+                emit("partial", {"stage": stage, "response": partial})
+    return on_token
+
+@app.post("/response/pipeline")
+async def generate_pipeline_response(request: MessageRequest):
+    # Runs initial -> critique -> improved -> video validation in one request and
+    # streams stage progress and partial tokens back as server-sent events.
+    participantId = request.participantId
+    user_message = request.user_message
+    if not user_message:
+        raise HTTPException(status_code=400, detail="No message provided")
+
+    async def run_pipeline(emit):
+        bind(participant_id=participantId)
+        session = ParticipantSession(participantId)
+        await session.load()
+        if not session.exists:
+            session.create()
+        session.set_fields(user_message=user_message)
 
-        improved_response = chat_app.get_improved_response(user_message, initial_response, critique_response)
+        # Step 1
+        emit("stage", {"stage": "initial", "status": "started"})
+        initial_response = await chat_app.chat(user_message, participantId, on_token=token_emitter(emit, "initial", PartialJSONAssembler()))
+        if not initial_response or (isinstance(initial_response, dict) and "error" in initial_response):
+            raise RuntimeError("No response received from OpenAI")
+        session.append_messages(user_message, initial_response)
+        await session.commit()
+        emit("stage", {"stage": "initial", "status": "done", "response": initial_response})
+
+        # Step 2
+        emit("stage", {"stage": "critique", "status": "started"})
+        critique_response = await chat_app.get_critique_response(initial_response, on_token=token_emitter(emit, "critique"))
+        if not critique_response:
+            raise RuntimeError("Failed to generate critique response")
+        session.append_messages("Critique of Initial Response", critique_response)
+        await session.commit()
+        emit("stage", {"stage": "critique", "status": "done", "response": critique_response})
+
+        # Step 3
+        emit("stage", {"stage": "improved", "status": "started"})
+        improved_response = await chat_app.get_improved_response(user_message, initial_response, critique_response, on_token=token_emitter(emit, "improved", PartialJSONAssembler()))
         if not improved_response:
-            raise HTTPException(status_code=500, detail="Failed to generate improved response")
-            
-        print("START UPDATED IMPROVED RESPONSE")
-        # Process the improved response to check and replace invalid YouTube videos
+            raise RuntimeError("Failed to generate improved response")
+        emit("stage", {"stage": "improved", "status": "done"})
+
+        emit("stage", {"stage": "validation", "status": "started"})
         updated_improved_response = await process_improved_response(user_message, improved_response)
+        session.append_messages("Improved Response", updated_improved_response)
+        track_plan(session, updated_improved_response)
+        await session.commit()
+        emit("stage", {"stage": "validation", "status": "done"})
 
-        # Store the updated improved response
-        store_messages(participantId, "Improved Response", updated_improved_response)
-        print("Stored improved response with valid YouTube video IDs")
-        print(updated_improved_response)
-        return {"response": updated_improved_response}
+        emit("done", {"response": updated_improved_response})
 
-    except TypeError as e:
-        print(f"TypeError in improved response: {e}")
-        raise HTTPException(status_code=500, detail="Type error encountered while generating improved response")
+    return stream_events(run_pipeline, "pipeline")
 
-    except Exception as e:
-        print(f"Error in improved response: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate improved response")
+class JobRequest(BaseModel):
+    participantId: str
+    user_message: str = None
+    kind: str = "pipeline"
 
-async def process_improved_response(user_message: str, improved_response: str) -> str:
-    # Parse the improved response as JSON
+async def submit_job(kind: str, participantId: str, user_message: str = None):
+    # Returns right away; the client polls GET /jobs/{job_id} or subscribes to its events
+    bind(participant_id=participantId)
     try:
-        # Attempt to find JSON in the response
-        json_match = re.search(r'```json([\s\S]*?)```', improved_response)
-        if json_match:
-            json_text = json_match.group(1).strip()
-        else:
-            json_text = improved_response.strip()
-        
-        if not isinstance(json_text, str):
-            print("json_text is not a string.")
-            return improved_response
+        job = await job_runner.submit(kind, participantId, {"user_message": user_message})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Error submitting {kind} job: {e}")
+        raise HTTPException(status_code=500, detail="Failed to submit job")
+    return JSONResponse(status_code=202, content={"job_id": job["job_id"], "status": job["status"]})
+
+@app.post("/jobs")
+async def create_job(request: JobRequest):
+    if request.kind in ("response", "pipeline") and not request.user_message:
+        raise HTTPException(status_code=400, detail="No message provided")
+    return await submit_job(request.kind, request.participantId, request.user_message)
+
+# Declared before /jobs/{job_id} so GET /jobs/resume is not taken for a job ID
+@app.api_route("/jobs/resume", methods=["GET", "POST"])
+async def resume_stale_jobs():
+    # Worker path for a scheduler (cron jobs call it with GET). The instance may be
+    # frozen once the response is sent, so stale jobs are run within this request
+    # rather than left to background tasks
+    job_ids = await job_runner.resume_stale(budget=JOB_RUN_BUDGET_SECONDS)
+    return {"resumed": job_ids}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    # Subscribing is read-only: closing this stream does not affect the job
+    if await job_runner.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        updates = job_runner.watch(job_id)
+        next_update = None
+        try:
+            while True:
+                if next_update is None:
+                    next_update = asyncio.ensure_future(anext(updates, None))
+                done, _ = await asyncio.wait({next_update}, timeout=SSE_KEEPALIVE_SECONDS)
+                if not done:
+                    yield ": keep-alive\n\n"
+                    continue
+                job, next_update = next_update.result(), None
+                if job is None:
+                    break
+                view = public_view(job)
+                yield sse_event({"done": "done", "failed": "error"}.get(view["status"], "status"), view)
+        finally:
+            if next_update is not None:
+                next_update.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    # Worker path for one job: picks up a job whose worker went away, or retries a
+    # failed one from its last checkpoint, and runs it within this request (see
+    # JobRunner.run); a job still running elsewhere is left alone
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        try:
+            await job_runner.retry(job_id)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    if job["status"] != "done":
+        await job_runner.run(job_id)
+    return public_view(await job_runner.get(job_id))
+
+# These stages write history themselves; the once keys keep a re-run stage from writing it twice
+@job_runner.handler("response")
+async def run_response_job(job):
+    return await job.stage("initial", lambda: respond_to_message(job.participant_id, job.params["user_message"], once=job.history_key("initial")))
+
+@job_runner.handler("critique")
+async def run_critique_job(job):
+    return await job.stage("critique", lambda: critique_for(job.participant_id, once=job.history_key("critique")))
+
+@job_runner.handler("improved")
+async def run_improved_job(job):
+    return await job.stage("improved", lambda: improve_for(job.participant_id, job.params.get("user_message"), once=job.history_key("improved")))
+
+@job_runner.handler("pipeline")
+async def run_pipeline_job(job):
+    # The /response/pipeline stages with a checkpoint after each one; on a resumed
+    # attempt, finished stages are skipped and their saved output reused
+    participantId = job.participant_id
+    user_message = job.params["user_message"]
+    session = ParticipantSession(participantId)
+    await session.load()
+    if not session.exists:
+        session.create()
+
+    def append_to_history(stage, request_text, **fields):
+        async def store(response):
+            session.append_messages(request_text, response)
+            session.set_fields(**fields)
+            await session.commit(once=job.history_key(stage))
+        return store
+
+    async def initial():
+        response = await chat_app.chat(user_message, participantId)
+        if not response or (isinstance(response, dict) and "error" in response):
+            raise RuntimeError("No response received from OpenAI")
+        return response
 
-        response_data = json.loads(json_text)
+    async def critique():
+        response = await chat_app.get_critique_response(initial_response)
+        if not response:
+            raise RuntimeError("Failed to generate critique response")
+        return response
 
-    except json.JSONDecodeError:
-        # If parsing fails, return the response as is
-        print("Improved response is not valid JSON")
+    async def improved():
+        response = await chat_app.get_improved_response(user_message, initial_response, critique_response)
+        if not response:
+            raise RuntimeError("Failed to generate improved response")
+        return response
+
+    initial_response = await job.stage("initial", initial, append_to_history("initial", user_message, user_message=user_message))
+    critique_response = await job.stage("critique", critique, append_to_history("critique", "Critique of Initial Response"))
+    improved_response = await job.stage("improved", improved)
+
+    async def validation():
+        return await process_improved_response(user_message, improved_response)
+
+    async def store_plan(plan):
+        track_plan(session, plan)
+        await append_to_history("validation", "Improved Response")(plan)
+
+    return await job.stage("validation", validation, store_plan)
+
+async def process_improved_response(user_message: str, improved_response) -> str:
+    # Accepts the plan dict from ChatApp, or text from older callers, and serializes once at the end
+    response_data = parse_study_plan(improved_response)
+    if response_data is None:
+        # If it is not a study plan, return the response as is
+        logger.warning("Improved response is not a valid study plan")
         return improved_response
-    except Exception as e:
-        print(f"Error parsing improved_response: {e}")
-        return improved_response 
 
     # Process the study plan
-    if 'studyPlan' in response_data:
-        study_plan = response_data['studyPlan']
-        print("before calling check_and_replace_invalid_videos")
-        updated_study_plan = await check_and_replace_invalid_videos(user_message, study_plan)
-        response_data['studyPlan'] = updated_study_plan
-        # Convert back to JSON string
-        updated_response_text = json.dumps(response_data, indent=2)
-        return updated_response_text
-    else:
-        # If no study plan, return the response as is
-        return improved_response
+    response_data['studyPlan'] = await check_and_replace_invalid_videos(user_message, response_data['studyPlan'])
+    # Convert back to JSON string
+    return json.dumps(response_data, indent=2)
+
+def iter_youtube_resources(study_plan: dict):
+    # Yields every YouTube resource entry in the plan
+    for week_value in study_plan.values():
+        if not isinstance(week_value, list):
+            continue
+        for day in week_value:
+            # The unvalidated fallback plan may hold anything here
+            if not isinstance(day, dict) or not isinstance(day.get('resources'), dict):
+                continue
+            youtube_resources = day['resources'].get('YouTube', [])
+            if not isinstance(youtube_resources, list):
+                youtube_resources = [youtube_resources]
+            for resource in youtube_resources:
+                if isinstance(resource, dict):
+                    yield resource
+
+def collect_video_ids(study_plan: dict) -> dict:
+    # Maps every link in the plan to its video ID (None if it can't be extracted)
+    link_ids = {}
+    for resource in iter_youtube_resources(study_plan):
+        link = resource.get('link')
+        if link in link_ids:
+            continue
+        try:
+            link_ids[link] = extract_video_id(link)
+        except Exception as e:
+            logger.warning(f"Error extracting video ID from {link}: {e}")
+            link_ids[link] = None
+    return link_ids
+
+# Bound on concurrent replacement searches per plan
+REPLACEMENT_CONCURRENCY = int(os.getenv("REPLACEMENT_CONCURRENCY", "8"))
 
 async def check_and_replace_invalid_videos(user_message: str, study_plan: dict) -> dict:
-    print("THIS IS A STUDY PLAN", study_plan)
+    debug_dump(logger, "Validating study plan", study_plan)
     invalid_urls_cache = set()
-    resources_sumup = []
+    used_video_ids = set()
+    invalid_slots = []
+
+    # Stage 1: validate every unique video in the plan up front, in batched requests
+    link_ids = collect_video_ids(study_plan)
+    with span("videos.validate"):
+        valid_ids = await check_videos_validity({video_id for video_id in link_ids.values() if video_id})
 
+    # Stage 2: record the videos kept and the slots that need a replacement
     for week_key, week_value in study_plan.items():
+        if not isinstance(week_value, list):
+            continue
         for day in week_value:
-            resources = day.get('resources', {})
+            if not isinstance(day, dict) or not isinstance(day.get('resources'), dict):
+                continue
+            resources = day['resources']
             if 'YouTube' in resources:
                 youtube_resources = resources['YouTube']
                 if not isinstance(youtube_resources, list):
                     youtube_resources = [youtube_resources]
 
                 for idx, resource in enumerate(youtube_resources):
+                    if not isinstance(resource, dict):
+                        continue
                     link = resource.get('link')
                     if link in invalid_urls_cache:
                         continue  # Skip URLs that have already been processed
 
-                    try:
-                        video_id = extract_video_id(link)
-                    except Exception as e:
-                        print(f"Error extracting video ID from {link}: {e}")
-                        video_id = None
+                    video_id = link_ids.get(link)
 
                     # Check if the video is valid
-                    if link and video_id and await check_video_validity(video_id):
-                        resources_sumup.append(resource)
+                    if link and video_id and video_id in valid_ids:
+                        used_video_ids.add(video_id)
                         continue  # Valid video, move to next resource
 
                     # Invalid links
-                    print(f"Invalid YouTube URL detected: {link}")
+                    logger.info(f"Invalid YouTube URL detected: {link}", extra={"sample": True})
                     invalid_urls_cache.add(link)
+                    invalid_slots.append((youtube_resources, idx, day.get('topic', '')))
 
-                    topic = day.get('topic', '')
-
-                    # Loop to find a unique replacement video
-                    max_attempts = 5  # Limit to avoid infinite loops
-                    attempts = 0
-                    while attempts < max_attempts:
-                        similar_video = await find_replacement_video(user_message, topic)
-                        attempts += 1
-
-                        if similar_video:
-                            similar_link = similar_video.get('link')
-                            # Check if the similar video's link is already in resources_sumup
-                            if any(res.get('link') == similar_link for res in resources_sumup):
-                                print("It already exists, trying to find another video...")
-                                continue  # Try to find another video
-                            else:
-                                youtube_resources[idx] = similar_video  # Replace invalid with valid
-                                print(f"Replaced invalid video with {similar_video['link']}")
-                                resources_sumup.append(similar_video)
-                                break  # Found a unique video, exit loop
-                        else:
-                            print(f"No similar video found for topic: {topic}")
-                            break  # Exit loop if no video found
-
-                    else:
-                        # If max_attempts reached without finding a unique video
-                        print(f"Could not find a unique replacement video for topic: {topic}")
-                        # youtube_resources[idx] = None  # Remove invalid resource
-
-                # Clean up None entries from youtube_resources
-                youtube_resources = [res for res in youtube_resources if res is not None]
                 resources['YouTube'] = youtube_resources
                 day['resources'] = resources
 
-    print("All resources collected:", resources_sumup)
-    return study_plan
-
+    # Stage 3: search replacements for all invalid slots concurrently
+    semaphore = asyncio.Semaphore(REPLACEMENT_CONCURRENCY)
+    with span("videos.replace"):
+        await asyncio.gather(*(
+            replace_invalid_resource(user_message, youtube_resources, idx, topic, used_video_ids, semaphore)
+            for youtube_resources, idx, topic in invalid_slots
+        ))
+    count("videos.replaced", len(invalid_slots))
 
+    logger.info("Validated plan videos", extra={"videos": len(used_video_ids), "replaced": len(invalid_slots)})
+    return study_plan
 
+async def replace_invalid_resource(user_message: str, youtube_resources: list, idx: int, topic: str, used_video_ids: set, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        query = build_replacement_query(user_message, topic)
+        try:
+            # The Google client is blocking, so the search runs in a worker thread
+            candidates = await asyncio.to_thread(search_similar_candidates, query)
+        except Exception as e:
+            logger.warning(f"Error in search: {e}")
+            candidates = []
+
+    # No await between the check and the add, so concurrent slots never pick the same video
+    for item in candidates:
+        video_id = item['id'].get('videoId')
+        if video_id and video_id not in used_video_ids:
+            used_video_ids.add(video_id)
+            similar_video = {
+                'title': item['snippet'].get('title', 'No Title'),
+                'link': f"https://www.youtube.com/watch?v={video_id}"
+            }
+            youtube_resources[idx] = similar_video  # Replace invalid with valid
+            logger.info(f"Replaced invalid video with {similar_video['link']}", extra={"sample": True})
+            return
+    logger.warning(f"Could not find a unique replacement video for topic: {topic}")
 
-async def find_replacement_video(user_message:str, topic: str) -> dict:
-    # Finds a similar video for the given topic by querying the search function.
-    print("USER MESSAGE IN FIND_REPLACEMENT_VIDEO", user_message)
+def build_replacement_query(user_message: str, topic: str) -> str:
     proficiency_match = re.search(r"(Novice|Advanced Beginner|Competence|Proficiency|Expertise|Mastery)", user_message, re.IGNORECASE)
     proficiency = proficiency_match.group(1) if proficiency_match else "unknown level"
     topic_match = re.search(r"on (\w+)", user_message, re.IGNORECASE)
     extracted_topic = topic_match.group(1) if topic_match else "unknown topic"
-    duration_match = re.search(r"over (\d+) months?, (\d+) weeks?, and (\d+) days?", user_message, re.IGNORECASE)
-    duration = {
-        "months": int(duration_match.group(1)) if duration_match else 0,
-        "weeks": int(duration_match.group(2)) if duration_match else 0,
-        "days": int(duration_match.group(3)) if duration_match else 0
-    }
     hours_match = re.search(r"(\d+) hours? available per day", user_message, re.IGNORECASE)
     hours_per_day = int(hours_match.group(1)) if hours_match else 0
-    full_query = f"{topic} in {extracted_topic} for a {proficiency} in {hours_per_day} hours"
-
-    result = await search_similar_video(full_query)
-    if result:
-        return result
-
-    return None
-
+    return f"{topic} in {extracted_topic} for a {proficiency} in {hours_per_day} hours"
+
+async def check_videos_validity(video_ids) -> set:
+    # Returns the subset of video_ids that exist. Cached answers are used first;
+    # the rest are checked in concurrent batches and written back to the cache.
+    # IDs in a batch that could not be checked (quota, timeout) count as valid:
+    # replacing them would cost a 100-unit search each for videos that likely exist.
+    video_ids = list(dict.fromkeys(video_ids))
+    if not video_ids:
+        return set()
+    records = await asyncio.to_thread(video_cache.get_many, video_ids, "snippet")
+    missing = [video_id for video_id in video_ids if video_id not in records]
+    unverified = set()
+    if missing:
+        batches = [missing[i:i + VIDEO_BATCH_SIZE] for i in range(0, len(missing), VIDEO_BATCH_SIZE)]
+        session = await get_session()
+        results = await asyncio.gather(*(fetch_video_snippets(session, batch) for batch in batches))
+        fetched = {}
+        for batch, result in zip(batches, results):
+            if result is None:
+                unverified.update(batch)
+            else:
+                fetched.update(result)
+        if unverified:
+            logger.warning(f"Could not verify {len(unverified)} videos, keeping them")
+            count("videos.unverified", len(unverified))
+        if fetched:
+            await asyncio.to_thread(video_cache.set_many, fetched, "snippet")
+        records.update(fetched)
+    return {video_id for video_id, record in records.items() if record["exists"]} | unverified
+
+async def fetch_video_snippets(session: aiohttp.ClientSession, video_ids: list):
+    # Returns {video_id: record} for one batch, or None if the batch could not be checked.
+    # part=snippet costs the same single quota unit as part=id and also fills the metadata cache.
+    # Rotates keys like execute_youtube when a key is exhausted or rate limited.
+    for _ in range(max(len(key_pool), 1)):
+        try:
+            key_name, api_key = key_pool.acquire(QUOTA_COST["videos.list"])
+        except ValueError as e:
+            logger.warning(f"Error while checking video validity: {e}")
+            return None
 
-async def check_video_validity(video_id: str) -> bool:
-    if not video_id:
-        return False
-    api_key = None
-    if youtube_api_keys:
-        selected_key = random.choice(youtube_api_keys)
-        api_key = os.getenv(selected_key)
-    if not api_key:
-        return False
-
-    url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={api_key}&part=id"
-    async with aiohttp.ClientSession() as session:
+        params = {"id": ",".join(video_ids), "key": api_key, "part": "snippet", "maxResults": VIDEO_BATCH_SIZE}
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 403:
-                        print("Quota exceeded or access forbidden.")
-                        return False
-                    elif response.status != 200:
-                        print(f"HTTP error: {response.status}")
-                        return False
-
-                    data = await response.json()
-                    items = data.get("items", [])
-                    return len(items) > 0
+            with span("youtube.videos.list"):
+                response = await session.get(YOUTUBE_VIDEOS_URL, params=params)
+            async with response:
+                if response.status in (400, 403, 429):
+                    reason = error_reason(await response.read())
+                    if key_pool.report_failure(key_name, response.status, reason):
+                        logger.warning("Quota exceeded or key invalid, trying another key.", extra={"key": key_name})
+                        continue
+                    logger.warning(f"HTTP error: {response.status} ({reason})")
+                    return None
+                elif response.status != 200:
+                    logger.warning(f"HTTP error: {response.status}")
+                    return None
+
+                data = await response.json()
+                records = {video_id: {"exists": False, "data": {}} for video_id in video_ids}
+                for item in data.get("items", []):
+                    records[item["id"]] = {"exists": True, "data": item.get("snippet", {})}
+                return records
         except Exception as e:
-            print(f"Error while checking video validity: {e}")
-            return False
-
-
-async def search_similar_video(search_query: str) -> dict:
-    # First attempt with full query
-    response = await execute_search_query(search_query)
-    if response:
-        return response
-    return None
-
-async def execute_search_query(query: str) -> dict:
-    try:
-        # Directly call the function that searches for similar videos
-        similar_video_response = search_similar_videos(query)
-        if similar_video_response.get('exists'):
-            video_id = similar_video_response.get('videoId')
-            title = similar_video_response.get('title')
-            link = f"https://www.youtube.com/watch?v={video_id}"
-            return {'title': title, 'link': link}
-        else:
-            print(f"No video found for query: {query}")
+            logger.warning(f"Error while checking video validity: {e}")
             return None
-    except Exception as e:
-        print(f"Error in search: {e}")
-        return None
+    return None
 
 @app.post("/info")
 async def generate_info_response(request: InfoRequest):
     try: 
         if not request.info_message:
             raise HTTPException(status_code=400, detail="No info message provided")
-        else:
-            response = client.with_options(timeout=120.0).chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a helpful assistant to explain background knowledge based on the subject that users want to study. " 
-                        "Here we have 6 levels of background expertise ('novice', 'advanced beginner', 'competence', 'proficiency', 'expertise', 'mastery'). "
-                        "1. Novice: Novices rely heavily on context-free rules and step-by-step instructions. Their performance tends to be slow, clumsy, and requires conscious effort. Novices struggle to adapt when situations don't align with the instructions. A novice cook strictly follows recipe measurements and timing, regardless of variations in ingredients or peculiarities of the oven. A novice driver might rigidly maintain speed limits without considering traffic flow or the presence of pedestrians. Novices have a detached approach to outcomes. To progress, novices need to keep gaining experience and making mistakes in a variety of situations.\n"
-                        "2. Advanced Beginner: Advanced beginners recognize situation-specific nuances and can apply experience-based maxims beyond general rules. For instance, an advanced beginner cook might adjust heat based on the smell and look of the food as it is cooking rather than just the instructions in the recipe. They have had enough experience to recognize the smell of burning oil and can now apply the maxim that “the smell of burning oil usually means the heat is too high.”  An advanced beginner chess player begins to recognize such aspects of situation such as \'weakened king’s side\' and can apply the maxim to \'attack a weakened king\’s side.\' The performance of an advanced beginner is more sophisticated than novice, but it is still analytical. They continue to struggle with unfamiliar situations. At the same time, they begin to feel more emotionally engaged, often becoming overwhelmed or frustrated. Progression requires building further emotional involvement and commitment to outcomes.\n"
-                        "3. Competence: Competent performers choose specific goals and adopt an overall perspective on what their situation calls for. A competent cook can choose to have the cold dishes ready before the hot ones. A competent chess player could choose an attacking strategy, focusing on the moves and pieces that support this plan. Success and failure now partially depend on the performer’s choice of perspective and not just on how well they follow rules. This leads to higher emotional involvement, with competent performers feeling joy or regret according to the outcomes. While more fluid than advanced beginners, competent performance still proceeds by analysis, calculation, and deliberate rule-following. Competent performers show improved coordination and anticipation but may rigidly stick to chosen perspectives even when circumstances change. To advance to proficiency, more risks need to be taken with letting go of rules and procedures while trusting one’s emerging intuition.\n" 
-                        "4. Proficiency: Proficient performers intuitively grasp what a situation calls for but consciously decide responses. When a perspective intuitively occurs to them, proficient nurses can instantly sense a patient\'s deterioration before vital signs change. However, they then deliberately consider treatment options. Proficient drivers instinctively tell they\'re going too fast on a rainy curve but then consciously decide whether to brake or decelerate. Proficient performers adapt better to changing circumstances but still rely on rule-based decision-making for actions. The transition to expertise requires further letting go of rules and procedures while gaining more direct experience learning which intuited perspectives work in which kind of situation.\n"
-                        "5. Expertise: Experts demonstrate seamless integration of perception and action. An expert chef creates dishes without recipes, intuitively adjusting techniques and ingredients based on specific circumstances. Expert drivers intuitively lift their foot off the accelerator rather than braking. Their performance happens without deliberation or decision-making. Experts often struggle to precisely explain their actions. When circumstances abruptly change, experts smoothly adapt and shift perspectives in a \"reflexive reorientation.\" For example, expert nurses constantly attend to subtle transitions in a patient’s condition. They intuitively shift perspectives and initiate a corresponding shift in treatment when solicited by transitions in the patient’s condition.\n"
-                        "6. Mastery:  Masters seek to expand and refine their repertoire of intuitive perspectives. In doing so, they sometimes create new possibilities of performing and transform the style of their domain. For example, Cézanne expanded the possibilities for the painting of form and perspective, Stephen Curry altered the style of play in basketball by making the 3-point shot central rather than marginal, and B.B. King transformed the space of possibilities in music by harnessing the previously marginal capacity of the electric guitar to sustain notes. Masters identify overlooked aspects of a practice and experiment with new approaches, accepting short-term drops in particular performances for long-term expansions in their intuition.\n"
-                        "Format your response as a clean **HTML <table>**."
-                        "The table should have two columns: Level and Description."
-                        "Using table format below and make it easy to read." 
-                        "Each description should contain bullet points inside an unordered list (`<ul><li>…</li></ul>`)."
-                        "Each sentence starts with a new bullet point."
-                        "Be concise."
-                        "Use proper HTML tags and indentation."
-                        "Here are the 6 levels to include:\
-                        - Novice\
-                        - Advanced Beginner\
-                        - Competence\
-                        - Proficiency\
-                        - Expertise\
-                        - Mastery\
-                        Start directly with `<table>...</table>`, and make sure the output is valid HTML."
-                    )
-                },
-                {"role": "user", "content": request.info_message}
-            ],
-            temperature=0.2,
-            top_p=0.6,
-            frequency_penalty=0.2,
-            presence_penalty=0.1)
+        info_messages = Prompts.info_messages(request.info_message)
+        # Near-identical question for everyone, so the answer is served from the response cache
+        info_params = dict(temperature=0.2, top_p=0.6, frequency_penalty=0.2, presence_penalty=0.1, label="info", cache=True)
 
-        response_received = response.choices[0].message.content
+        if request.stream:
+            async def run_info(emit):
+                chunks = []
+                async for token in llm.stream(info_messages, timeout=120.0, **info_params):
+                    chunks.append(token)
+                    emit("token", {"stage": "info", "token": token})
+                emit("done", {"response": "".join(chunks)})
+
+            return stream_events(run_info, "info")
+
+        response_received = await llm.complete(info_messages, timeout=120.0, **info_params)
         return {"response": response_received}
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception(f"Error: {str(e)}")
 
 @app.post("/search")
 async def generate_search_response(request: SearchRequest):
     search_message = request.search_message
-    response_resources = get_search_response(search_message)
+    response_resources = await asyncio.to_thread(get_search_response, search_message)
     return {"response": response_resources}
 
 @app.post('/get_thumbnail')
@@ -436,7 +837,7 @@ async def get_thumbnail(request: YouTubeVideoID):
     if not video_id:
         raise HTTPException(status_code=400, detail="No URL provided")
 
-    thumbnail_url = get_video_thumbnail(video_id)
+    thumbnail_url = await asyncio.to_thread(get_video_thumbnail, video_id)
     if thumbnail_url:
         return {"thumbnail": thumbnail_url}
     else:
@@ -446,9 +847,9 @@ async def get_thumbnail(request: YouTubeVideoID):
 async def get_video_statistics(request: YouTubeVideoID):
     try:
         video_id = request.video_id
-        stats = get_video_stats(video_id)
+        stats = await asyncio.to_thread(get_video_stats, video_id)
         if not stats:  # If stats are unavailable, fall back to similar videos
-            similar_video = search_similar_videos(video_id)
+            similar_video = await asyncio.to_thread(search_similar_videos, video_id)
             return {
                 "views": similar_video.get("views", "N/A"),
                 "likes": similar_video.get("likes", "N/A"),
@@ -457,258 +858,260 @@ async def get_video_statistics(request: YouTubeVideoID):
             }
         return {"views": stats['views'], "likes": stats['likes'], "fallback": False}
     except Exception as e:
-        print(f"Error occurred while fetching video stats: {e}")
+        logger.warning(f"Error occurred while fetching video stats: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch video statistics")
 
 @app.post("/search_similar_videos")
 async def find_similar_videos(request: SearchRequest):
     search_message = request.search_message
-    print("Finding similar videos for:", search_message)
+    logger.info(f"Finding similar videos for: {search_message}")
 
     try:
-        # Get a random API key
-        selected_key = random.choice(youtube_api_keys)
-        YOUTUBE_API_KEY = os.getenv(selected_key)
-
         # Call the search_similar_videos function from YouTube_request.py
-        similar_video_response = search_similar_videos(search_message)
+        similar_video_response = await asyncio.to_thread(search_similar_videos, search_message)
 
         return similar_video_response
 
     except Exception as e:
-        print(f"Error finding similar videos: {e}")
+        logger.warning(f"Error finding similar videos: {e}")
         raise HTTPException(status_code=500, detail="Failed to find similar videos")
 
 
+@app.get("/quota")
+async def get_quota_usage():
+    # Per-key YouTube quota counters; key values are never returned
+    return key_pool.usage()
+
+@app.get("/llm/usage")
+async def get_llm_usage():
+    # Token totals per endpoint, including prompt tokens served from the provider's prefix cache
+    return llm.usage_stats()
+
+@app.get("/llm/cache")
+async def get_llm_cache_stats():
+    return response_cache.stats()
+
 @app.post("/checkResource")
 async def generate_check_response(request: CheckRequest):
     check_message = request.check_message
     research_query = request.research_query
     participantId = request.participantsId
     try:
-        response_check = check_resource_availability(check_message, research_query)
+        response_check = await asyncio.to_thread(check_resource_availability, check_message, research_query)
         return {"response": response_check}
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/plan-reasoning")
-async def generate_plan_reasoning(request: PlanRequest):
+def plan_hash(plan_text) -> str:
+    # Identifies one version of a plan, independent of key order and whitespace
     try:
-        # Retrieve the most recent study plan from storage
-        recent_messages = get_recent_messages(request.participantId)
-        improved_response_message = None
-        study_plan_response = None
-
-        for i, msg in enumerate(recent_messages):
-            if msg.get('content') == 'Improved Response' and msg.get('role') == 'user':
-                improved_response_message = msg['content']
-                if i + 1 < len(recent_messages) and recent_messages[i + 1].get('role') == 'assistant':
-                    study_plan_response = recent_messages[i + 1]['content']
-                break
+        plan = json.loads(plan_text) if isinstance(plan_text, str) else plan_text
+        canonical = json.dumps(plan, sort_keys=True, separators=(",", ":"))
+    except (TypeError, json.JSONDecodeError):
+        canonical = str(plan_text)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def track_plan(session: ParticipantSession, plan_text):
+    # Records the current plan version on the session and precomputes its week
+    # reasoning, which the frontend asks for next. Responses that are not study
+    # plans are skipped: their reasoning would never be looked up.
+    if parse_study_plan(plan_text) is None:
+        return
+    session.set_fields(plan_hash=plan_hash(plan_text))
+    run_in_background(precompute_plan_reasoning(plan_text))
+
+async def precompute_plan_reasoning(plan_text):
+    # Runs outside any request; a failure only means /plan-reasoning generates it on demand
+    try:
+        await plan_reasoning_for(plan_text)
+    except Exception as e:
+        logger.warning(f"Precomputing plan reasoning failed: {e}")
 
-        if not improved_response_message or not study_plan_response:
-            raise HTTPException(status_code=404, detail="No 'Improved Response' message found")
+async def plan_reasoning_for(plan_text) -> str:
+    # Reasoning for every week of one plan version, generated once and shared by all week requests
+    try:
+        study_plan = json.loads(plan_text) if isinstance(plan_text, str) else plan_text
+    except json.JSONDecodeError:
+        raise ValueError("Failed to parse study plan response as JSON")
+    study_plan_overview_str = json.dumps(study_plan.get('studyPlan_Overview', {}))
 
-        try:
-            study_plan_response = json.loads(study_plan_response)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=500, detail="Failed to parse study plan response as JSON")
-        study_plan_overview = study_plan_response.get('studyPlan_Overview', {})
-        study_plan_overview_str = json.dumps(study_plan_overview)
-        response = client.with_options(timeout=120.0).chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        f"You are a helpful assistant. Please review the study plan provided based on {study_plan_response} and generate detailed explanations for each week, focusing on three distinct aspects: Learning Objectives, Content Selection, and Connection.\n"
-                        "Provide concise explanations in complete sentences and separate the reasoning into JSON format as follows:\n\n"
-                        "1. Learning Objectives: Your task is to generate clear and concise learning objectives for each week using Bloom's Taxonomy.\n\
-                            Please refer these guidance: these 6 levels can be used to structure the learning outcomes, lessons, and assessments of your course.\
-                            1) Remembering: Retrieving, recognizing, and recalling relevant knowledge from long‐term memory.\
-                            2) Understanding: Constructing meaning from oral, written, and graphic messages through interpreting, exemplifying, classifying, summarizing, inferring, comparing, and explaining.\
-                            3) Applying: Carrying out or using a procedure for executing, or implementing.\
-                            4) Analyzing: Breaking material into constituent parts, determining how the parts relate to one another and to an overall structure or purpose through differentiating, organizing, and attributing.\
-                            5) Evaluating: Making judgments based on criteria and standards through checking and critiquing.\
-                            6) Creating: Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure through generating, planning, or producing.\
-                            Bloom’s is hierarchical, meaning that learning at the higher levels is dependent on having attained prerequisite knowledge and skills at lower levels.\
-                            How Bloom’s can aid in study plan design? Bloom’s taxonomy is a powerful tool to help develop learning outcomes because it explains the process of learning:\
-                                1) Before you can understand a concept, you must remember it.\
-                                2) To apply a concept you must first understand it.\
-                                3) In order to evaluate a process, you must have analyzed it.\
-                                4) To create an accurate conclusion, you must have completed a thorough evaluation.\
-                                However, we don’t always start with lower order skills and step all the way through the entire taxonomy for each concept you present in your course. That approach would become tedious–for both you and your students! Instead, start by considering the level of learners in your course:\
-                                    - Is this an “Introduction to…” course? If so, many your learning outcomes may target the lower order Bloom’s skills, because your students are building foundational knowledge. However, even in this situation we would strive to move a few of your outcomes into the applying and analyzing level, but getting too far up in the taxonomy could create frustration and unachievable goals.\
-                                    - Do your students have a solid foundation in much of the terminology and processes you will be working on your course? If so, then you should not have many remembering and understanding level outcomes. You may need a few, for any radically new concepts specific to your course. However, these advanced students should be able to master higher-order learning objectives. Too many lower level outcomes might cause boredom or apathy.\
-                            Steps towards writing effective learning outcomes:\
-                                1) Make sure there is one measurable verb in each objective.\
-                                2) Each outcome needs one verb. Either a student can master the outcome , or they fail to master it. If an outcome has two verbs (say, define and apply), what happens if a student can define, but not apply? Are they demonstrating mastery?\
-                                3) Ensure that the verbs in the course level outcome are at least at the highest Bloom’s Taxonomy as the highest lesson level outcomes that support it. (Because we can’t verify they can evaluate if our lessons only taught them (and assessed) to define.)\
-                                4) Strive to keep all your learning outcomes measurable, clear and concise."
-                        "2. Content Selection:\n"
-                            "Justify the reasons for the selection of resources based on the following:\
-                                1) Personalization: Resources should match the learner's current abilities and gradually introduce complexity\
-                                2) Diversity and Accessibility: Easy access through platforms ensures flexibility.\
-                                3) Engagement and Interactivity: Interactive elements like quizzes, discussions, and hands-on exercises increase retention and understanding.\
-                                4) Quality Content: Resources should be accurate, well-structured, and created by credible experts.\
-                                5) Encouraging Potential: Content should not be too easy or too difficult; it must push learners slightly beyond their comfort zone to foster growth without overwhelming them.\
-                                6) Alignment with Goals: Resources should be relevant to the learner's academic, professional, or personal objectives."
-                        "3. Connection:\n"
-                            "Explain how the content relates to previously covered material to ensure continuity and coherence.\
-                            Focus on an aligned approach to planning and implementing strategies where all elements—goals, actions, resources, and assessments—are interconnected and mutually reinforcing."
-                            "Highlight how this week’s content sets the foundation for subsequent learning, enabling skill progression. "
-                            "Focus on how the progression helps build a comprehensive understanding of the subject and supports gradual mastery.\n"                      
-                            
-                        "Provide the response in this structured JSON format: "
-                        "{\n"
-                        "    \"Week1\": \"- Learning objective: Describe what learners will achieve this week, using Bloom's verbs.\n"
-                        "               - Content selection: Explain why this specific content was chosen to meet the objective.\n"
-                        "               - Connection: Describe how this week’s content prepares learners for the next week or builds on prior knowledge.\",\n"
-                        "    \"Week2\": \"- Learning objective...\n"
-                        "               - Content selection...\n"
-                        "               - Connection...\n\",\n"
-                        "    \"Week3\": \"- Learning objective...\n"
-                        "               - Content selection...\n"
-                        "               - Connection...\n\",\n"
-                        "    \"Week4\": \"- Learning objective...\n"
-                        "               - Content selection...\n"
-                        "               - Connection...\n\"\n"
-                        "}\n\n"
-                        "For each section, ensure that do not mention theory explicitly in the results"
-                    )
-                },
-                {"role": "user", "content": study_plan_overview_str}
-            ],
+    async def generate():
+        return await llm.complete(
+            Prompts.plan_reasoning_messages(study_plan, study_plan_overview_str),
+            timeout=120.0,
             temperature=0.0,
             top_p=0.6,
             frequency_penalty=0.2,
-            presence_penalty=0.1
+            presence_penalty=0.1,
+            label="plan-reasoning"
         )
-        response_received = response.choices[0].message.content
 
+    return await plan_reasoning_cache.get_or_complete(plan_hash(study_plan), generate, model=llm.model)
+
+@app.post("/plan-reasoning")
+async def generate_plan_reasoning(request: PlanRequest):
+    try:
+        # The session records which plan version is current; its reasoning is usually precomputed
+        bind(participant_id=request.participantId)
+        session = ParticipantSession(request.participantId)
+        await session.load()
+        current_hash = session.get("plan_hash")
+        if current_hash:
+            cached = await plan_reasoning_cache.get(current_hash)
+            if cached is not None:
+                return {"response": cached}
+
+        # Otherwise find the latest improved plan in the recent history
+        recent_messages = await session.recent_messages()
+        study_plan_response = None
+        for i in range(len(recent_messages) - 2, -1, -1):
+            msg = recent_messages[i]
+            if msg.get('content') == 'Improved Response' and msg.get('role') == 'user' and recent_messages[i + 1].get('role') == 'assistant':
+                study_plan_response = recent_messages[i + 1]['content']
+                break
+
+        if not study_plan_response:
+            raise HTTPException(status_code=404, detail="No 'Improved Response' message found")
+
+        response_received = await plan_reasoning_for(study_plan_response)
         return {"response": response_received}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def latest_study_plan(recent_messages):
+    # Most recent assistant message carrying a plan, stored either as a dict or as JSON text
+    for message in reversed(recent_messages):
+        if message.get("role") != "assistant":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            try:
+                content = json.loads(content)
+            except json.JSONDecodeError:
+                continue
+        if isinstance(content, dict) and "studyPlan" in content:
+            return content["studyPlan"]
+    return None
+
+def plan_topics(study_plan) -> list:
+    topics = []
+    for days in (study_plan or {}).values():
+        if isinstance(days, list):
+            topics.extend(day["topic"] for day in days if isinstance(day, dict) and day.get("topic"))
+    return list(dict.fromkeys(topics))
+
+# kind -> (single-topic prompt, multi-topic prompt, usage label)
+TOPIC_DETAIL_KINDS = {
+    "explanations": (Prompts.topic_explanation_messages, Prompts.topic_explanations_bulk_messages, "topic-explanations"),
+    "objectives": (Prompts.objectives_messages, Prompts.objectives_bulk_messages, "generate-objectives"),
+}
+TOPIC_BATCH_SIZE = int(os.getenv("TOPIC_BATCH_SIZE", "10"))
+TOPIC_PARAMS = dict(temperature=0.0, top_p=0.6, frequency_penalty=0.2, presence_penalty=0.1)
+
+async def topic_details(kind: str, topics: list, recent_plan: str) -> dict:
+    # Answers per (kind, plan version, topic) are cached, so single and bulk requests share them.
+    # Misses are answered TOPIC_BATCH_SIZE topics per JSON-mode call, batches in parallel.
+    single_messages, bulk_messages, label = TOPIC_DETAIL_KINDS[kind]
+    version = plan_hash(recent_plan)
+    keys = {topic: hashlib.sha256(json.dumps([kind, version, topic]).encode("utf-8")).hexdigest() for topic in topics}
+    cached = await asyncio.gather(*(topic_cache.get(keys[topic]) for topic in topics))
+    results = {topic: text for topic, text in zip(topics, cached) if text is not None}
+    missing = [topic for topic in topics if topic not in results]
+
+    async def answer_one(topic):
+        return await llm.complete(single_messages(topic, recent_plan), timeout=120.0, label=label, cache=True, **TOPIC_PARAMS)
+
+    async def answer_batch(batch):
+        answers = {}
+        if len(batch) > 1:
+            try:
+                text = await llm.complete(
+                    bulk_messages(batch, recent_plan),
+                    timeout=120.0,
+                    label=f"{label}-bulk",
+                    response_format={"type": "json_object"},
+                    **TOPIC_PARAMS
+                )
+                parsed = json.loads(text)
+                if isinstance(parsed, dict):
+                    # Objectives sometimes come back as a list instead of numbered text
+                    answers = {topic: "\n".join(f"{i}. {item}" for i, item in enumerate(answer, 1)) if isinstance(answer, list) else answer for topic, answer in parsed.items()}
+                else:
+                    logger.warning(f"Bulk {kind} call returned {type(parsed).__name__} instead of an object, answering topics one by one")
+            except Exception as e:
+                logger.warning(f"Error in bulk {kind} call, answering topics one by one: {e}")
+        # Topics the batch answer left out are asked one at a time
+        retry = [topic for topic in batch if not isinstance(answers.get(topic), str) or not answers[topic].strip()]
+        for topic, answer in zip(retry, await asyncio.gather(*(answer_one(topic) for topic in retry))):
+            answers[topic] = answer
+        for topic in batch:
+            results[topic] = answers[topic]
+            await topic_cache.set(keys[topic], answers[topic])
+
+    await asyncio.gather(*(answer_batch(missing[i:i + TOPIC_BATCH_SIZE]) for i in range(0, len(missing), TOPIC_BATCH_SIZE)))
+    return {topic: results[topic] for topic in topics}
+
 @app.post("/topic-explanations")
 async def generate_topic_explanation(request: UserMessageRequest):
     try:
-        recent_messages = get_recent_messages(request.participantId)
+        bind(participant_id=request.participantId)
+        recent_messages = await ParticipantSession(request.participantId).recent_messages()
         # Data - recent improved study plan
-        improved_study_plan = None
-        for message in reversed(recent_messages):
-            # Check if this is the improved response containing 'studyPlan'
-            if message.get("role") == "assistant" and isinstance(message.get("content"), dict):
-                content = message["content"]
-                if "studyPlan" in content:
-                    improved_study_plan = content["studyPlan"]
-                    break
+        improved_study_plan = latest_study_plan(recent_messages)
         recent_plan = json.dumps(improved_study_plan) if improved_study_plan else "No study plan available."
         topic = request.user_message
-        response = client.with_options(timeout=120.0).chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        f"You are a helpful assistant to explain why the topic '{topic}' is important and essential in the context of this study plan '{recent_plan}'.\n"
-                        "Please provide accurate and relevant explanations for the reasons for studying each topic by referring to these guidelines:\
-                            - To direct and assist the student in learning the content of each assignment, it is useful first to consider the learning needs of students in studying an assignment and, hence, to examine what functions various components might play in fulfilling these needs.\
-                            - Orientation: It is beneficial for students to begin studying an assignment with a general idea of what they will encounter in the assignment. \
-                            This approach is ingrained in contemporary educational thinking and supported by research on learning (Hartley and Davis, 1976). Ausubel (1968) has strongly argued that a preliminary framework of what is to come—what he calls an \"advance organizer\"—can greatly facilitate learning, and he has demonstrated its practical utility.\
-                            A general framework sets the scope of the assignment and shows how it fits into the overall course. It also illustrates how the topics within the assignment are partitioned and interrelated. Furthermore, it can highlight the relevance of the assignment for the student.\
-                            Another aspect of orientation is goal-setting. It is helpful for students to be aware of the goals they are expected to achieve while studying an assignment (Melton, 1978). \
-                            This awareness enables them to focus their efforts on reaching those goals and helps them maintain perspective on their learning progress throughout the assignment. \
-                            Consider the contrast between goal-directed study and a situation where the student is unsure of the relative importance of different parts of the assignment content. \
-                            Goal awareness leads to more organized study and improved learning outcomes for the student (Duchastel and Merrill, 1973)."
-                        f"Only provide **reason for study this '{topic}'**; Do not repeat the study plan content; Do not mention theory explicitly in the results; Be concise, as fewer as possible."
-                    )
-                    },
-                    {"role": "user", "content": recent_plan}
-            ],
-            temperature=0.0,
-            top_p=0.6,
-            frequency_penalty=0.2,
-            presence_penalty=0.1
-        )
-        response_received = response.choices[0].message.content
+        response_received = (await topic_details("explanations", [topic], recent_plan))[topic]
         return {"explanation": response_received}        
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/generate-objectives")
 async def generate_learning_objectives(request: UserMessageRequest):
     try:
-        recent_messages = get_recent_messages(request.participantId)
+        bind(participant_id=request.participantId)
+        recent_messages = await ParticipantSession(request.participantId).recent_messages()
         if not recent_messages:
             raise HTTPException(status_code=404, detail="No study plan found")
 
         # Data - recent improved study plan
-        improved_study_plan = None
-        for message in reversed(recent_messages):
-            # Check if this is the improved response containing 'studyPlan'
-            if message.get("role") == "assistant" and isinstance(message.get("content"), dict):
-                content = message["content"]
-                if "studyPlan" in content:
-                    improved_study_plan = content["studyPlan"]
-                    break
+        improved_study_plan = latest_study_plan(recent_messages)
         recent_plan = json.dumps(improved_study_plan) if improved_study_plan else "No study plan available."
         topic = request.user_message
-
-        # Generate the prompt for GPT-4o
-        response = client.with_options(timeout=120.0).chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        f"You are a helpful assistant. This is a study plan with specific topics: '{recent_plan}'." 
-                        f"Your task is to generate clear and concise learning objectives with as fewer points as possible for the topic '{topic}' using Bloom's Taxonomy."                    
-                        "Please refer these guidance: these 6 levels can be used to structure the learning outcomes, lessons, and assessments of your course.\
-                            1. Remembering: Retrieving, recognizing, and recalling relevant knowledge from long‐term memory.\
-                            2. Understanding: Constructing meaning from oral, written, and graphic messages through interpreting, exemplifying, classifying, summarizing, inferring, comparing, and explaining.\
-                            3. Applying: Carrying out or using a procedure for executing, or implementing.\
-                            4. Analyzing: Breaking material into constituent parts, determining how the parts relate to one another and to an overall structure or purpose through differentiating, organizing, and attributing.\
-                            5. Evaluating: Making judgments based on criteria and standards through checking and critiquing.\
-                            6. Creating: Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure through generating, planning, or producing."
-                        "Bloom’s is hierarchical, meaning that learning at the higher levels is dependent on having attained prerequisite knowledge and skills at lower levels."
-                        "How Bloom’s can aid in study plan design? Bloom’s taxonomy is a powerful tool to help develop learning outcomes because it explains the process of learning:\
-                            1. Before you can understand a concept, you must remember it.\
-                            2. To apply a concept you must first understand it.\
-                            3. In order to evaluate a process, you must have analyzed it.\
-                            4. To create an accurate conclusion, you must have completed a thorough evaluation.\
-                            However, we don’t always start with lower order skills and step all the way through the entire taxonomy for each concept you present in your course. That approach would become tedious–for both you and your students! Instead, start by considering the level of learners in your course:\
-                                - Is this an “Introduction to…” course? If so, many your learning outcomes may target the lower order Bloom’s skills, because your students are building foundational knowledge. However, even in this situation we would strive to move a few of your outcomes into the applying and analyzing level, but getting too far up in the taxonomy could create frustration and unachievable goals.\
-                                - Do your students have a solid foundation in much of the terminology and processes you will be working on your course? If so, then you should not have many remembering and understanding level outcomes. You may need a few, for any radically new concepts specific to your course. However, these advanced students should be able to master higher-order learning objectives. Too many lower level outcomes might cause boredom or apathy."
-                        "Steps towards writing effective learning outcomes:\
-                            1. Make sure there is one measurable verb in each objective.\
-                            2. Each outcome needs one verb. Either a student can master the outcome , or they fail to master it. If an outcome has two verbs (say, define and apply), what happens if a student can define, but not apply? Are they demonstrating mastery?\
-                            3. Ensure that the verbs in the course level outcome are at least at the highest Bloom’s Taxonomy as the highest lesson level outcomes that support it. (Because we can’t verify they can evaluate if our lessons only taught them (and assessed) to define.)\
-                            4. Strive to keep all your learning outcomes measurable, clear and concise."
-                        "Validate whether these learning objectives can be achieved within the hours the user wants to study. If not, reduce them."                        
-                        "Must include only learning objectives. Numbering all learning objectives."
-                        "For example, \
-                            1. learning objective\
-                            2. learning objective\
-                            ..."
-                    )
-                },
-                {"role": "user", "content": recent_plan}
-            ],
-            temperature=0.0,
-            top_p=0.6,
-            frequency_penalty=0.2,
-            presence_penalty=0.1
-        )
-        response_received = response.choices[0].message.content
+        response_received = (await topic_details("objectives", [topic], recent_plan))[topic]
         return {"objectives": response_received}
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/topics/bulk")
+async def generate_topic_details_bulk(request: BulkTopicsRequest):
+    # Explanations and objectives for many topics at once, e.g. every day of the current plan
+    unknown = [kind for kind in request.kinds if kind not in TOPIC_DETAIL_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kinds: {', '.join(unknown)}")
+    try:
+        bind(participant_id=request.participantId)
+        recent_messages = await ParticipantSession(request.participantId).recent_messages()
+        improved_study_plan = latest_study_plan(recent_messages)
+        if request.topics is None and not improved_study_plan:
+            raise HTTPException(status_code=404, detail="No study plan found")
+        topics = list(dict.fromkeys(request.topics if request.topics is not None else plan_topics(improved_study_plan)))
+        recent_plan = json.dumps(improved_study_plan) if improved_study_plan else "No study plan available."
+
+        details = await asyncio.gather(*(topic_details(kind, topics, recent_plan) for kind in request.kinds))
+        return dict(zip(request.kinds, details))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
     
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+# fake_services.py
+# Local stand-ins for the OpenAI chat completions API and the YouTube Data API,
+# with configurable latency and failure rates, for the offline benchmark.
+# Only the endpoints and response fields the backend actually uses are served.
+import asyncio
+import json
+import random
+import string
+import time
+from aiohttp import web
+
+
+def random_video_id(prefix=""):
+    return prefix + "".join(random.choices(string.ascii_letters + string.digits, k=11 - len(prefix)))
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class ServiceProfile:
+    """Latency (mean and jitter, in ms) and failure rate applied to every call of one service."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, failure_status=503):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+
+    async def delay(self, scale=1.0):
+        seconds = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) * scale / 1000
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    def failed(self):
+        return random.random() < self.failure_rate
+
+
+class FakeOpenAI:
+    """POST /v1/chat/completions. JSON-mode calls get a study plan, others a short text answer."""
+
+    def __init__(self, profile, weeks=4, videos_per_day=2, invalid_video_rate=0.1, tokens_per_second=0):
+        self.profile = profile
+        self.weeks = weeks
+        self.videos_per_day = videos_per_day
+        self.invalid_video_rate = invalid_video_rate
+        # 0 streams every chunk at once
+        self.tokens_per_second = tokens_per_second
+        self.calls = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        return app
+
+    def plan(self):
+        # Video IDs starting with "bad" are reported missing by FakeYouTube
+        overview, weeks = {}, {}
+        for week in range(1, self.weeks + 1):
+            overview[f"Week{week}"] = f"Overview of topics for week {week}"
+            weeks[f"Week {week}: Topic {week}"] = [
+                {
+                    "day": f"Day {day}",
+                    "topic": f"Week {week} day {day} topic",
+                    "Time": "1 hour",
+                    "resources": {"YouTube": [
+                        {
+                            "title": f"Video {n} for week {week} day {day}",
+                            "link": f"https://youtu.be/{random_video_id('bad' if random.random() < self.invalid_video_rate else '')}"
+                        }
+                        for n in range(1, self.videos_per_day + 1)
+                    ]}
+                }
+                for day in range(1, 6)
+            ]
+        return {"studyPlan_Overview": overview, "studyPlan": weeks}
+
+    def answer(self, body):
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps(self.plan())
+        return "- The plan is well structured.\n- Add more practice exercises.\n- Balance the weekly workload."
+
+    @staticmethod
+    def usage(body, content):
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in body.get("messages", []))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(content),
+            "total_tokens": prompt_tokens + estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+
+    async def completions(self, request):
+        self.calls += 1
+        body = await request.json()
+        await self.profile.delay()
+        if self.profile.failed():
+            return web.json_response({"error": {"message": "fake failure", "type": "server_error"}}, status=self.profile.failure_status)
+
+        content = self.answer(body)
+        created = int(time.time())
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"chatcmpl-{self.calls}",
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": self.usage(body, content)
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        step = 40
+        for start in range(0, len(content), step):
+            piece = content[start:start + step]
+            chunk = {
+                "id": f"chatcmpl-{self.calls}", "object": "chat.completion.chunk", "created": created, "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if self.tokens_per_second:
+                await asyncio.sleep(estimate_tokens(piece) / self.tokens_per_second)
+        final = {
+            "id": f"chatcmpl-{self.calls}", "object": "chat.completion.chunk", "created": created, "model": body.get("model"),
+            "choices": [], "usage": self.usage(body, content)
+        }
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+
+class FakeYouTube:
+    """GET /youtube/v3/videos and /youtube/v3/search, as googleapiclient and the raw aiohttp calls use them.
+
+    Random failures (the profile's failure rate) are transient: 503 backendError,
+    or 429 rateLimitExceeded. Quota exhaustion is a separate knob: with
+    `quota_per_key`, a key that has spent that many units gets 403 quotaExceeded.
+    """
+
+    TRANSIENT_REASONS = {429: "rateLimitExceeded", 503: "backendError"}
+
+    def __init__(self, profile, quota_per_key=None):
+        self.profile = profile
+        self.quota_per_key = quota_per_key
+        self.units = {}
+        self.calls = {"videos.list": 0, "search.list": 0}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/youtube/v3/videos", self.videos)
+        app.router.add_get("/youtube/v3/search", self.search)
+        return app
+
+    @staticmethod
+    def snippet(video_id):
+        return {
+            "title": f"Video {video_id}",
+            "description": "Benchmark video",
+            "channelTitle": "Benchmark channel",
+            "publishedAt": "2024-01-01T00:00:00Z",
+            "thumbnails": {"default": {"url": f"https://i.ytimg.com/vi/{video_id}/default.jpg"}}
+        }
+
+    @staticmethod
+    def error(status, reason):
+        # Same body shape as the real API, so the key pool can read error.errors[].reason
+        return web.json_response({"error": {"code": status, "message": reason, "errors": [{"reason": reason, "domain": "youtube"}]}}, status=status)
+
+    def failure(self, request, units):
+        """An error response for this call, or None if it succeeds."""
+        if self.quota_per_key is not None:
+            key = request.query.get("key", "")
+            if self.units.get(key, 0) + units > self.quota_per_key:
+                return self.error(403, "quotaExceeded")
+            self.units[key] = self.units.get(key, 0) + units
+        if self.profile.failed():
+            status = self.profile.failure_status
+            return self.error(status, self.TRANSIENT_REASONS.get(status, "backendError"))
+        return None
+
+    async def videos(self, request):
+        self.calls["videos.list"] += 1
+        await self.profile.delay()
+        failure = self.failure(request, 1)
+        if failure is not None:
+            return failure
+        ids = [video_id for video_id in request.query.get("id", "").split(",") if video_id]
+        parts = request.query.get("part", "snippet").split(",")
+        items = []
+        for video_id in ids:
+            if video_id.startswith("bad"):
+                continue
+            item = {"kind": "youtube#video", "id": video_id}
+            if "snippet" in parts:
+                item["snippet"] = self.snippet(video_id)
+            if "statistics" in parts:
+                item["statistics"] = {"viewCount": "1000", "likeCount": "10", "commentCount": "1"}
+            items.append(item)
+        return web.json_response({"kind": "youtube#videoListResponse", "items": items, "pageInfo": {"totalResults": len(items)}})
+
+    async def search(self, request):
+        self.calls["search.list"] += 1
+        # search.list is noticeably slower than videos.list on the real API
+        await self.profile.delay(scale=2.0)
+        failure = self.failure(request, 100)
+        if failure is not None:
+            return failure
+        max_results = int(request.query.get("maxResults", "5"))
+        items = []
+        for _ in range(max_results):
+            video_id = random_video_id("s")
+            items.append({"kind": "youtube#searchResult", "id": {"kind": "youtube#video", "videoId": video_id}, "snippet": self.snippet(video_id)})
+        return web.json_response({"kind": "youtube#searchListResponse", "items": items})
+
+
+async def start_service(app, host="127.0.0.1", port=0):
+    """Serve `app` in the running loop; returns (runner, base_url)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
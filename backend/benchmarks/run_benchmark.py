@@ -0,0 +1,172 @@
+# run_benchmark.py
+# Offline load benchmark for the plan pipeline.
+# Starts FakeOpenAI and FakeYouTube locally, runs the FastAPI app under uvicorn
+# against them and the Firestore emulator, and drives simulated participants
+# through /response -> /response/critique -> /response/improved (which includes
+# check_and_replace_invalid_videos). Reports p50/p95/p99 latency per endpoint,
+# plans/s, and quota units and tokens per plan from the app's /metrics counters.
+#
+# Needs the Firestore emulator, e.g.
+#   gcloud emulators firestore start --host-port=127.0.0.1:8085
+#   FIRESTORE_EMULATOR_HOST=127.0.0.1:8085 python benchmarks/run_benchmark.py --participants 50 --concurrency 10
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import aiohttp
+from fake_services import FakeOpenAI, FakeYouTube, ServiceProfile, start_service
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLAN_REQUEST = "Create a study plan for a novice student on {topic} using YouTube over 1 months, 0 weeks, and 0 days with 1 hours available per day."
+STAGES = [("/response", True), ("/response/critique", False), ("/response/improved", False)]
+REPORTED_COUNTERS = ["youtube.quota_units", "llm.prompt_tokens", "llm.cached_tokens", "llm.completion_tokens", "videos.replaced"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def start_app(port, openai_url, youtube_url, args, log_file):
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "API_KEY1": "benchmark",
+        "GOOGLE_API_ENDPOINT": youtube_url,
+        "LLM_CACHE_ENABLED": "0" if args.no_llm_cache else "1",
+        **{f"YOUTUBE_API_KEY{i}": f"benchmark-key-{i}" for i in range(1, args.youtube_keys + 1)},
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+
+
+async def wait_until_up(session, base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not start within {timeout}s")
+
+
+async def run_participant(session, base_url, index, args, latencies, errors):
+    participant_id = f"bench-{args.run_id}-{index}"
+    topic = f"topic {index % args.distinct_topics}" if args.distinct_topics else f"topic {index}"
+    for path, sends_message in STAGES:
+        payload = {"participantId": participant_id}
+        if sends_message:
+            payload["user_message"] = PLAN_REQUEST.format(topic=topic)
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{base_url}{path}", json=payload) as response:
+                await response.read()
+                ok = response.status == 200
+        except Exception:
+            ok = False
+        latencies[path].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            errors[path] += 1
+            return False
+    return True
+
+
+async def main(args):
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("Set FIRESTORE_EMULATOR_HOST to a running Firestore emulator; the benchmark never touches real Firestore.")
+
+    fake_openai = FakeOpenAI(ServiceProfile(args.llm_latency_ms, args.llm_latency_ms / 4, args.llm_failure_rate), weeks=args.weeks, invalid_video_rate=args.invalid_video_rate)
+    fake_youtube = FakeYouTube(
+        ServiceProfile(args.youtube_latency_ms, args.youtube_latency_ms / 4, args.youtube_failure_rate, failure_status=args.youtube_failure_status),
+        quota_per_key=args.youtube_quota_per_key
+    )
+    openai_runner, openai_url = await start_service(fake_openai.app())
+    youtube_runner, youtube_url = await start_service(fake_youtube.app())
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log_file = tempfile.NamedTemporaryFile(prefix="planglow-benchmark-", suffix=".log", delete=False)
+    app_process = start_app(port, openai_url, youtube_url, args, log_file)
+
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await wait_until_up(session, base_url)
+            async with session.get(f"{base_url}/metrics") as response:
+                before = (await response.json())["counters"]
+
+            latencies = {path: [] for path, _ in STAGES}
+            errors = {path: 0 for path, _ in STAGES}
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(index):
+                async with semaphore:
+                    return await run_participant(session, base_url, index, args, latencies, errors)
+
+            started = time.perf_counter()
+            completed = sum(await asyncio.gather(*(limited(i) for i in range(args.participants))))
+            elapsed = time.perf_counter() - started
+
+            async with session.get(f"{base_url}/metrics") as response:
+                after = await response.json()
+    finally:
+        app_process.terminate()
+        app_process.wait(timeout=30)
+        log_file.close()
+        await openai_runner.cleanup()
+        await youtube_runner.cleanup()
+
+    print(f"\n{args.participants} participants, concurrency {args.concurrency}, {elapsed:.1f}s")
+    print(f"Completed plans: {completed}  ({completed / elapsed:.2f} plans/s)")
+    print(f"\n{'endpoint':<24}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path, values in latencies.items():
+        print(f"{path:<24}{len(values):>9}{errors[path]:>8}{len(values) / elapsed:>8.2f}"
+              f"{percentile(values, 0.50):>10.0f}{percentile(values, 0.95):>10.0f}{percentile(values, 0.99):>10.0f}")
+
+    print("\nPer completed plan:")
+    for name in REPORTED_COUNTERS:
+        delta = after["counters"].get(name, 0) - before.get(name, 0)
+        print(f"  {name:<24}{delta / completed if completed else 0:>10.1f}")
+
+    print(f"\n{'app span':<40}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in after["spans"].items():
+        print(f"{name:<40}{stats['count']:>7}{stats['p50_ms']:>10.0f}{stats['p95_ms']:>10.0f}{stats['p99_ms']:>10.0f}")
+    print(f"\nFake API calls: openai={fake_openai.calls} youtube={fake_youtube.calls}")
+    print(f"App log: {log_file.name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load benchmark with fake OpenAI and YouTube services.")
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--weeks", type=int, default=4, help="weeks per generated plan")
+    parser.add_argument("--distinct-topics", type=int, default=0, help="cycle through this many topics (0: every participant unique)")
+    parser.add_argument("--llm-latency-ms", type=float, default=2000)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--youtube-latency-ms", type=float, default=100)
+    parser.add_argument("--youtube-failure-rate", type=float, default=0.0, help="rate of transient YouTube errors")
+    parser.add_argument("--youtube-failure-status", type=int, choices=[429, 503], default=503)
+    parser.add_argument("--youtube-quota-per-key", type=int, default=None, help="quota units per key before 403 quotaExceeded (default: unlimited)")
+    parser.add_argument("--youtube-keys", type=int, default=3)
+    parser.add_argument("--invalid-video-rate", type=float, default=0.1)
+    parser.add_argument("--no-llm-cache", action="store_true", help="disable the LLM response cache in the app")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--run-id", default=uuid.uuid4().hex[:8])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,131 @@
+# API_key_pool.py
+# Quota-aware pool of YouTube Data API keys.
+# Keys are handed out least-used first, usage is counted in quota units, and a
+# key whose quota is used up (or that is invalid) is put on cooldown instead of
+# being dropped forever; a rate-limited key only briefly. Other errors, such as a
+# malformed request, say nothing about the key and leave it in rotation.
+# Quota resets at midnight Pacific time, which also ends every cooldown.
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from components.Metrics import count
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    from zoneinfo import ZoneInfo
+    PACIFIC = ZoneInfo("America/Los_Angeles")
+except Exception:
+    PACIFIC = timezone(timedelta(hours=-8))
+
+DAILY_QUOTA_UNITS = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+RATE_LIMIT_COOLDOWN_SECONDS = 60
+
+# Error reasons (error.errors[].reason) that take a key out until the quota reset
+EXHAUSTED_REASONS = {"quotaExceeded", "dailyLimitExceeded", "keyInvalid", "keyExpired"}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# Quota cost per YouTube Data API call
+QUOTA_COST = {
+    "videos.list": 1,
+    "search.list": 100,
+}
+
+
+def next_quota_reset(now=None):
+    """Epoch seconds of the next midnight in Pacific time."""
+    now = datetime.now(PACIFIC) if now is None else now.astimezone(PACIFIC)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+
+def error_reason(content):
+    """The first error reason in a Google API error body (bytes, str or dict), if any."""
+    try:
+        body = json.loads(content) if isinstance(content, (bytes, str)) else content
+        errors = body["error"].get("errors") or []
+        return errors[0].get("reason") if errors else None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+class APIKeyPool:
+    def __init__(self, keys, daily_quota=DAILY_QUOTA_UNITS):
+        # keys: {name: api_key}
+        self.keys = dict(keys)
+        self.daily_quota = daily_quota
+        self._lock = threading.Lock()
+        self._reset_at = next_quota_reset()
+        self._stats = {name: self._empty_stats() for name in self.keys}
+
+    @classmethod
+    def from_env(cls, prefix="YOUTUBE_API_KEY"):
+        return cls({k: v for k, v in sorted(os.environ.items()) if k.startswith(prefix) and v})
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def _empty_stats():
+        return {"units": 0, "requests": 0, "failures": 0, "cooldown_until": 0.0}
+
+    def _maybe_reset(self, now):
+        if now >= self._reset_at:
+            self._stats = {name: self._empty_stats() for name in self.keys}
+            self._reset_at = next_quota_reset()
+
+    def acquire(self, units=1):
+        """Return (name, api_key) for the least-used key that can afford `units`."""
+        with self._lock:
+            now = time.time()
+            self._maybe_reset(now)
+            available = [
+                name for name, stats in self._stats.items()
+                if stats["cooldown_until"] <= now and stats["units"] + units <= self.daily_quota
+            ]
+            if not available:
+                raise ValueError("All API keys have exceeded quota or are invalid.")
+            name = min(available, key=lambda n: (self._stats[n]["units"], self._stats[n]["requests"]))
+            # Reserve the units up front so concurrent callers spread across keys
+            self._stats[name]["units"] += units
+            self._stats[name]["requests"] += 1
+        count("youtube.quota_units", units)
+        return name, self.keys[name]
+
+    def report_failure(self, name, status, reason=None):
+        """Cool a key down if the error was about the key; returns True if it was."""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return False
+            stats["failures"] += 1
+            if reason in EXHAUSTED_REASONS:
+                stats["cooldown_until"] = self._reset_at
+            elif status == 429 or reason in RATE_LIMIT_REASONS:
+                stats["cooldown_until"] = time.time() + RATE_LIMIT_COOLDOWN_SECONDS
+            else:
+                return False
+            logger.warning(f"API key {name} returned {status} ({reason}), cooling down until {datetime.fromtimestamp(stats['cooldown_until'], PACIFIC).isoformat()}.")
+            return True
+
+    def usage(self):
+        """Per-key counters (key values are never exposed)."""
+        with self._lock:
+            self._maybe_reset(time.time())
+            return {
+                "reset_at": datetime.fromtimestamp(self._reset_at, PACIFIC).isoformat(),
+                "daily_quota": self.daily_quota,
+                "keys": {
+                    name: {
+                        "units": stats["units"],
+                        "remaining": max(self.daily_quota - stats["units"], 0),
+                        "requests": stats["requests"],
+                        "failures": stats["failures"],
+                        "cooling_down": stats["cooldown_until"] > time.time(),
+                    }
+                    for name, stats in self._stats.items()
+                },
+            }
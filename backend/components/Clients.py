@@ -0,0 +1,119 @@
+# Clients.py
+# Registry of process-wide clients, each created on first use.
+# Importing the app no longer parses credentials or opens connections: Firebase
+# is initialized and the Firestore client built the first time something needs
+# them (or once, up front, from the FastAPI lifespan hook via warm_up()).
+# Creation times are recorded so the cold-start budget can be checked.
+import json
+import os
+import threading
+import time
+import firebase_admin
+from firebase_admin import credentials, firestore
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+init_timings = {}
+
+# Backoff between attempts to reach Firestore after a failure, doubling up to the max
+COLLECTION_RETRY_SECONDS = 5.0
+COLLECTION_RETRY_MAX_SECONDS = 300.0
+
+
+def _init_firebase():
+    # The app may already be initialized, e.g. by a script that set it up itself
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        service_account_info = json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT"])
+        firebase_admin.initialize_app(credentials.Certificate(service_account_info))
+
+
+def _create_firestore():
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # The emulator takes no credentials; used by the offline benchmarks
+        from google.cloud import firestore as cloud_firestore
+        return cloud_firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "demo-planglow"))
+    _init_firebase()
+    return firestore.client()
+
+
+FACTORIES = {
+    "firestore": _create_firestore,
+}
+
+
+def get_client(name):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = _clients[name] = FACTORIES[name]()
+                init_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+                logger.info(f"Created {name} client in {init_timings[name]} ms")
+    return client
+
+
+def get_firestore():
+    return get_client("firestore")
+
+
+def warm_up(*names):
+    for name in names or FACTORIES:
+        get_client(name)
+
+
+class LazyClient:
+    """Stands in for a client at module level and creates it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_client(self._name), attr)
+
+
+db = LazyClient("firestore")
+
+
+class LazyCollection:
+    """A Firestore collection resolved on first use.
+
+    get() returns None while Firestore is unavailable; creation is retried with
+    backoff, so a transient failure at startup does not disable the collection
+    for the life of the process. Set `enabled = False` to never touch Firestore.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = True
+        self._collection = None
+        self._retry_at = 0.0
+        self._backoff = COLLECTION_RETRY_SECONDS
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._collection is not None or not self.enabled or time.monotonic() < self._retry_at:
+            return self._collection
+        with self._lock:
+            if self._collection is None and time.monotonic() >= self._retry_at:
+                try:
+                    self._collection = get_firestore().collection(self.name)
+                    self._backoff = COLLECTION_RETRY_SECONDS
+                except Exception as e:
+                    logger.warning(f"Firestore collection {self.name} unavailable, retrying in {self._backoff:.0f}s: {e}")
+                    self._retry_at = time.monotonic() + self._backoff
+                    self._backoff = min(self._backoff * 2, COLLECTION_RETRY_MAX_SECONDS)
+        return self._collection
+
+    def require(self):
+        """Like get(), but raises for callers that cannot work without Firestore."""
+        collection = self.get()
+        if collection is None:
+            raise RuntimeError(f"Firestore collection {self.name} is unavailable")
+        return collection
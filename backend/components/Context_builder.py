@@ -0,0 +1,111 @@
+# Context_builder.py
+# Builds the conversation-history block of the chat_response prompt within a token budget.
+# Only the latest study plan is included in full; older plans are replaced by a
+# marker, recent turns are kept newest-first until the budget runs out, and the
+# turns that no longer fit are folded into a running summary cached per participant.
+import json
+import os
+from components.Cache import LRUCache
+from components.Conversation_store import count_tokens
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "6000"))
+CHAT_MESSAGE_MAX_TOKENS = 1000
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = 300
+PLAN_MARKER = "[earlier version of the study plan]"
+
+
+def is_plan(content):
+    if isinstance(content, dict):
+        return "studyPlan" in content
+    return isinstance(content, str) and '"studyPlan"' in content
+
+
+def content_as_text(content):
+    if isinstance(content, (dict, list)):
+        return json.dumps(content, separators=(",", ":"))
+    return str(content)
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    # ~4 characters per token is close enough for a cut-off
+    return text[:max_tokens * 4] + " …[truncated]"
+
+
+class ChatContextBuilder:
+    def __init__(self, llm, max_tokens=CHAT_CONTEXT_MAX_TOKENS, summary_model=CONTEXT_SUMMARY_MODEL):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.summary_model = summary_model
+        # participant_id -> {"count": turns covered, "summary": text}
+        self.summaries = LRUCache(maxsize=1000, ttl=24 * 3600)
+
+    async def build(self, participant_id, history):
+        """Return the history as prompt text, bounded by `max_tokens`."""
+        if not history:
+            return "No conversation history available."
+
+        latest_plan_index = max((i for i, entry in enumerate(history) if entry.get("role") == "assistant" and is_plan(entry.get("content"))), default=None)
+        latest_plan = content_as_text(history[latest_plan_index]["content"]) if latest_plan_index is not None else None
+
+        turns = []
+        for i, entry in enumerate(history):
+            content = entry.get("content")
+            if entry.get("role") == "assistant" and is_plan(content):
+                text = PLAN_MARKER if i != latest_plan_index else "[the latest study plan, shown below]"
+            else:
+                text = truncate_to_tokens(content_as_text(content), CHAT_MESSAGE_MAX_TOKENS)
+            turns.append(f"{entry.get('role')}: {text}")
+
+        budget = self.max_tokens - (count_tokens(latest_plan) if latest_plan else 0)
+        kept = []
+        used = 0
+        for turn in reversed(turns):
+            cost = count_tokens(turn)
+            if kept and used + cost > budget:
+                break
+            kept.append(turn)
+            used += cost
+        kept.reverse()
+        older = turns[:len(turns) - len(kept)]
+
+        sections = []
+        if older:
+            summary = await self.summarize(participant_id, older)
+            if summary:
+                sections.append(f"Summary of the earlier conversation:\n{summary}")
+        sections.append("\n".join(kept))
+        if latest_plan:
+            sections.append(f"Latest study plan:\n{latest_plan}")
+        return "\n\n".join(sections)
+
+    async def summarize(self, participant_id, older_turns):
+        # Extends the cached summary with only the turns it does not cover yet
+        cached = self.summaries.get(participant_id)
+        if cached and cached["count"] == len(older_turns):
+            return cached["summary"]
+        if cached and cached["count"] < len(older_turns):
+            previous, new_turns = cached["summary"], older_turns[cached["count"]:]
+        else:
+            previous, new_turns = "", older_turns
+
+        prompt = [
+            {"role": "system", "content": (
+                "Summarize this conversation between a learner and a study-plan assistant for later context. "
+                "Keep the learner's topic, level, schedule constraints and every change they asked for. "
+                "Do not reproduce study plans. Be concise."
+            )},
+            {"role": "user", "content": (f"Summary so far:\n{previous}\n\n" if previous else "") + "New turns:\n" + "\n".join(new_turns)}
+        ]
+        try:
+            summary = await self.llm.complete(prompt, timeout=60.0, model=self.summary_model, temperature=0.0, max_tokens=SUMMARY_MAX_TOKENS, label="summary")
+        except Exception as e:
+            logger.warning(f"Error summarizing conversation for {participant_id}: {e}")
+            return previous
+        self.summaries.set(participant_id, {"count": len(older_turns), "summary": summary})
+        return summary
@@ -0,0 +1,84 @@
+# Conversation_store.py
+# Bounded, per-participant conversation state for ChatApp.
+# Each participant gets their own message list; prompts are built from a
+# token-budgeted window of that list, and the least recently used
+# participants are evicted once the store is full.
+import os
+from collections import OrderedDict
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+MAX_PARTICIPANTS = int(os.getenv("CONVERSATION_MAX_PARTICIPANTS", "1000"))
+MAX_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", "8000"))
+MAX_MESSAGES = 50
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when available, else estimate ~4 chars per token."""
+    if not isinstance(text, str):
+        text = str(text)
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(message):
+    # ~4 tokens of per-message overhead in the chat format
+    return count_tokens(message.get("content", "")) + 4
+
+
+class ConversationStore:
+    def __init__(self, max_participants=MAX_PARTICIPANTS, max_tokens=MAX_CONTEXT_TOKENS, max_messages=MAX_MESSAGES):
+        self.max_participants = max_participants
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self._conversations = OrderedDict()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __contains__(self, participant_id):
+        return participant_id in self._conversations
+
+    def get(self, participant_id):
+        """Return the participant's messages (oldest first), marking them recently used."""
+        messages = self._conversations.get(participant_id)
+        if messages is None:
+            return []
+        self._conversations.move_to_end(participant_id)
+        return list(messages)
+
+    def append(self, participant_id, role, content):
+        messages = self._conversations.setdefault(participant_id, [])
+        self._conversations.move_to_end(participant_id)
+        messages.append({"role": role, "content": content})
+        # Hard cap on stored messages, independent of the token window
+        if len(messages) > self.max_messages:
+            del messages[:-self.max_messages]
+        while len(self._conversations) > self.max_participants:
+            evicted_id, _ = self._conversations.popitem(last=False)
+            logger.info(f"Evicted conversation for participant {evicted_id}.")
+
+    def window(self, participant_id, max_tokens=None):
+        """Return the newest messages that fit in `max_tokens`; the latest message is always kept."""
+        budget = max_tokens or self.max_tokens
+        selected = []
+        used = 0
+        for message in reversed(self.get(participant_id)):
+            cost = count_message_tokens(message)
+            if selected and used + cost > budget:
+                break
+            selected.append(message)
+            used += cost
+        selected.reverse()
+        return selected
+
+    def clear(self, participant_id):
+        self._conversations.pop(participant_id, None)
@@ -1,62 +1,466 @@
+import asyncio
 import json
+import os
+import threading
 import uuid
-import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, Conflict
+# Created on first use; see components/Clients.py
+from components.Clients import db
+from components.Metrics import span
+from components.Logger import get_logger
 
-db = firestore.client()
+logger = get_logger(__name__)
+
+# History lives in messages/{participantId}/history/{seq}, one document per message.
+# The parent document keeps the counters and `history_seq`, the last sequence number used.
+HISTORY_COLLECTION = "history"
+RECENT_MESSAGES_LIMIT = 10
+SESSION_DEFAULTS = {
+    "history_seq": 0,
+    "submit_count": 0,
+    "send_count": 0,
+    "additional_resources_count": 0,
+    "inline_count": 0
+}
+FIRESTORE_BATCH_LIMIT = 500
+# Keys of the most recent commit(once=...) calls kept on the session document
+APPENDED_ONCE_KEPT = 20
+WRITE_BEHIND_MAX_WRITES = 200
+WRITE_BEHIND_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+# Buffered writes are only visible to the process that buffered them, so
+# write-behind is opt-in for deployments where one long-lived process serves
+# every request. With several workers, or serverless instances that may freeze
+# before a flush, a follow-up request could miss the buffered history.
+WRITE_BEHIND_ENABLED = os.getenv("HISTORY_WRITE_BEHIND", "0") == "1"
+
+def session_ref_for(participant_id):
+    return db.collection("messages").document(participant_id)
+
+def history_ref_for(participant_id):
+    return session_ref_for(participant_id).collection(HISTORY_COLLECTION)
 
 def create_session(participant_id):
     try:
-        session_ref = db.collection("messages").document(participant_id)
-        session_ref.set({
-            "history": [],
-            "submit_count": 0,
-            "send_count": 0,
-            "additional_resources_count": 0,
-            "inline_count": 0
-        })
-        print(f"Session created for participant {participant_id}.")
+        session_ref = session_ref_for(participant_id)
+        session_ref.set(dict(SESSION_DEFAULTS))
+        logger.info(f"Session created for participant {participant_id}.")
         return session_ref
     except Exception as e:
-        print(f"Error creating session for participant {participant_id}: {e}")
+        logger.warning(f"Error creating session for participant {participant_id}: {e}")
 
-# Store Messages 
-def store_messages(participant_id, request_message, response_message):
-    session_ref = db.collection("messages").document(participant_id)
+def history_entry(seq, message):
+    return {
+        "seq": seq,
+        "role": message["role"],
+        "content": message["content"],
+        "created_at": firestore.SERVER_TIMESTAMP
+    }
+
+def append_history(participant_id, messages, fields=None):
+    # Allocates sequence numbers in a transaction and writes one document per message,
+    # together with any `fields` for the parent document.
+    # A legacy `history` array on the parent document is moved into the subcollection first.
+    session_ref = session_ref_for(participant_id)
+    history_ref = history_ref_for(participant_id)
+
+    @firestore.transactional
+    def append(transaction):
+        snapshot = session_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        legacy_history = data.get("history") or []
+        seq = data.get("history_seq", 0)
+
+        for message in legacy_history + messages:
+            seq += 1
+            transaction.set(history_ref.document(f"{seq:08d}"), history_entry(seq, message))
 
+        parent_update = {**(fields or {}), "history_seq": seq}
+        if "history" in data:
+            parent_update["history"] = firestore.DELETE_FIELD
+        if snapshot.exists:
+            transaction.update(session_ref, parent_update)
+        else:
+            transaction.set(session_ref, parent_update)
+        return seq
+
+    with span("firestore.history.transaction"):
+        return append(db.transaction())
+
+# Store Messages
+def store_messages(participant_id, request_message, response_message):
     # Prepare messages
     user_message = {"role": "user", "content": request_message}
     assistant_message = {"role": "assistant", "content": response_message}
 
     try:
-        # Check if document exists
-        if not session_ref.get().exists:
-            # Create the document if it doesn't exist
-            session_ref.set({"history": [user_message, assistant_message]})
-            print(f"New document created for participant {participant_id}.")
-        else:
-            # Update existing document
-            session_ref.update({"history": firestore.ArrayUnion([user_message, assistant_message])})
-            print(f"Messages appended for participant {participant_id}.")
+        append_history(participant_id, [user_message, assistant_message])
+        logger.debug(f"Messages appended for participant {participant_id}.")
     except Exception as e:
-        print(f"Error storing messages for participant {participant_id}: {e}")
+        logger.warning(f"Error storing messages for participant {participant_id}: {e}")
+
+def migrate_history(participant_id):
+    # Moves a legacy `history` array into the subcollection; no-op once migrated
+    append_history(participant_id, [])
+
+def add_history_write(batch, participant_id, entries, fields):
+    # Adds one participant's history entries (each carrying its `seq`) and parent fields to `batch`.
+    # create() fails the batch if a sequence number was already taken by another writer.
+    history_ref = history_ref_for(participant_id)
+    for entry in entries:
+        batch.create(history_ref.document(f"{entry['seq']:08d}"), history_entry(entry["seq"], entry))
+    if entries:
+        fields = {**fields, "history_seq": entries[-1]["seq"]}
+    batch.set(session_ref_for(participant_id), fields, merge=True)
+
+def stored_seqs(participant_id, entries):
+    # Sequence numbers of `entries` whose document already holds the same message
+    refs = [history_ref_for(participant_id).document(f"{entry['seq']:08d}") for entry in entries]
+    with span("firestore.history.get"):
+        stored = {snapshot.id: snapshot.to_dict() for snapshot in db.get_all(refs) if snapshot.exists}
+    seqs = set()
+    for entry in entries:
+        doc = stored.get(f"{entry['seq']:08d}")
+        if doc and doc.get("role") == entry["role"] and doc.get("content") == entry["content"]:
+            seqs.add(entry["seq"])
+    return seqs
+
+def commit_history_write(participant_id, entries, fields):
+    # Writes one participant's entries in a single batch, falling back to a
+    # transaction (which re-allocates sequence numbers) on a conflict
+    try:
+        batch = db.batch()
+        add_history_write(batch, participant_id, entries, fields)
+        with span("firestore.history.commit"):
+            batch.commit()
+        return entries[-1]["seq"] if entries else None
+    except (AlreadyExists, Conflict) as e:
+        # Entries found under their own seq were written by an earlier attempt
+        # (e.g. a flush whose result was lost) and must not be appended again
+        stored = stored_seqs(participant_id, entries)
+        remaining = [entry for entry in entries if entry["seq"] not in stored]
+        if not remaining:
+            logger.info(f"History for participant {participant_id} was already written")
+            if fields:
+                session_ref_for(participant_id).set(fields, merge=True)
+            return entries[-1]["seq"]
+        logger.warning(f"History sequence conflict for participant {participant_id}, retrying in a transaction: {e}")
+        messages = [{"role": entry["role"], "content": entry["content"]} for entry in remaining]
+        return append_history(participant_id, messages, fields)
+
+def merge_history(entries, pending):
+    # Union of stored and not-yet-flushed entries, ordered and de-duplicated by seq
+    merged = {entry["seq"]: entry for entry in entries}
+    for entry in pending:
+        merged.setdefault(entry["seq"], entry)
+    return [merged[seq] for seq in sorted(merged)]
+
+def query_history(participant_id, limit=None):
+    # Most recent entries (with seq) via an ordered, limited query; oldest first
+    query = history_ref_for(participant_id).order_by("seq", direction=firestore.Query.DESCENDING)
+    if limit:
+        query = query.limit(limit)
+    with span("firestore.history.query"):
+        entries = [
+            {"seq": doc.get("seq"), "role": doc.get("role"), "content": doc.get("content")}
+            for doc in query.stream()
+        ]
+    entries.reverse()
+    return entries
+
+def get_history(participant_id, limit=None):
+    # Oldest-first messages; with `limit`, only the most recent ones.
+    # Messages still waiting in the write-behind buffer are included (read-your-writes);
+    # the buffer is read first so an entry flushed in between is found by the query.
+    pending = history_writer.pending_messages(participant_id)
+    entries = merge_history(query_history(participant_id, limit), pending)
+    if limit:
+        entries = entries[-limit:]
+    if entries:
+        return [{"role": entry["role"], "content": entry["content"]} for entry in entries]
+
+    # Sessions written before the subcollection existed still keep an array on the parent
+    with span("firestore.session.get"):
+        session_doc = session_ref_for(participant_id).get()
+    legacy_history = (session_doc.to_dict() or {}).get("history") if session_doc.exists else None
+    if legacy_history:
+        migrate_history(participant_id)
+        return legacy_history[-limit:] if limit else legacy_history
+    return []
 
 # Get recent messages
-def get_recent_messages(participant_id):
+def get_recent_messages(participant_id, limit=RECENT_MESSAGES_LIMIT):
     try:
-        # Get session reference
-        session_ref = db.collection("messages").document(participant_id)
-        session_doc = session_ref.get()
-        if session_doc.exists:
-            session_data = session_doc.to_dict()
-            if 'history' in session_data:
-                # Retrieve the last 10 messages or fewer
-                recent_messages = session_data['history'][-10:]
-                return recent_messages
-        
-        print(f"No recent messages found for participant {participant_id}.")
+        recent_messages = get_history(participant_id, limit=limit)
+        if recent_messages:
+            return recent_messages
+
+        logger.debug(f"No recent messages found for participant {participant_id}.")
         return []
-    
+
     except Exception as e:
-        print(f"Error retrieving recent messages for participant {participant_id}: {e}")
-        return []
\ No newline at end of file
+        logger.warning(f"Error retrieving recent messages for participant {participant_id}: {e}")
+        return []
+
+
+class HistoryWriter:
+    # Write-behind buffer for history appends and session field updates.
+    # Requests enqueue their writes and return immediately; a background task
+    # commits everything buffered, across participants, in Firestore batch writes
+    # whenever `max_writes` operations are waiting or every `interval` seconds,
+    # and once more on shutdown. Buffered entries stay visible to readers of the
+    # same participant until they are durable.
+    def __init__(self, max_writes=WRITE_BEHIND_MAX_WRITES, interval=WRITE_BEHIND_INTERVAL, enabled=WRITE_BEHIND_ENABLED):
+        self.enabled = enabled
+        self.max_writes = max_writes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._queue = []
+        self._last_seq = {}
+        self._task = None
+        self._stopping = False
+        self._wake = None
+        self._flush_lock = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def enqueue(self, participant_id, base_seq, messages, fields):
+        """Buffer a write; returns the last sequence number it allocated."""
+        with self._lock:
+            seq = max(base_seq, self._last_seq.get(participant_id, 0))
+            entries = []
+            for message in messages:
+                seq += 1
+                entries.append({"seq": seq, "role": message["role"], "content": message["content"]})
+            self._queue.append({"participant_id": participant_id, "entries": entries, "fields": dict(fields)})
+            self._last_seq[participant_id] = seq
+            pending_writes = sum(len(write["entries"]) + 1 for write in self._queue)
+        if pending_writes >= self.max_writes:
+            self._wake.set()
+        return seq
+
+    def pending_messages(self, participant_id):
+        with self._lock:
+            return [entry for write in self._queue if write["participant_id"] == participant_id for entry in write["entries"]]
+
+    def pending_fields(self, participant_id):
+        fields = {}
+        with self._lock:
+            for write in self._queue:
+                if write["participant_id"] == participant_id:
+                    fields.update(write["fields"])
+        return fields
+
+    def last_seq(self, participant_id):
+        with self._lock:
+            return self._last_seq.get(participant_id)
+
+    async def start(self):
+        if self.running or not self.enabled:
+            return
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Error flushing history writes: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            with self._lock:
+                writes = list(self._queue)
+            if not writes:
+                return
+            await asyncio.to_thread(self._flush_writes, writes)
+            with self._lock:
+                # Only ever appended to, so the flushed writes are the queue's prefix
+                del self._queue[:len(writes)]
+                still_pending = {write["participant_id"] for write in self._queue}
+                for participant_id in {write["participant_id"] for write in writes} - still_pending:
+                    self._last_seq.pop(participant_id, None)
+
+    def _flush_writes(self, writes):
+        # Coalesce per participant (one parent update each), then pack into batches
+        coalesced = {}
+        for write in writes:
+            combined = coalesced.setdefault(write["participant_id"], {"entries": [], "fields": {}})
+            combined["entries"].extend(write["entries"])
+            combined["fields"].update(write["fields"])
+
+        chunks, chunk, chunk_writes = [], [], 0
+        for participant_id, combined in coalesced.items():
+            size = len(combined["entries"]) + 1
+            if chunk and chunk_writes + size > FIRESTORE_BATCH_LIMIT:
+                chunks.append(chunk)
+                chunk, chunk_writes = [], 0
+            chunk.append((participant_id, combined))
+            chunk_writes += size
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            try:
+                batch = db.batch()
+                for participant_id, combined in chunk:
+                    add_history_write(batch, participant_id, combined["entries"], combined["fields"])
+                with span("firestore.history.flush"):
+                    batch.commit()
+            except Exception as e:
+                # One conflicting participant fails the whole batch; retry each on its own
+                logger.warning(f"Batched history flush failed, writing individually: {e}")
+                for participant_id, combined in chunk:
+                    try:
+                        commit_history_write(participant_id, combined["entries"], combined["fields"])
+                    except Exception as e:
+                        logger.warning(f"Error storing messages for participant {participant_id}: {e}")
+
+    async def stop(self):
+        # Let the loop finish the flush it may be in rather than cancelling it:
+        # a cancelled flush leaves its already committed writes in the queue
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        if self._flush_lock is not None:
+            await self.flush()
+
+
+history_writer = HistoryWriter()
+
+
+class ParticipantSession:
+    # Request-scoped accessor for messages/{participantId}.
+    # The parent document is read at most once per request, history appends and
+    # field updates are buffered and written in a single batch (through the
+    # write-behind buffer when it is running), and all Firestore I/O runs in a
+    # worker thread so the event loop is never blocked.
+    def __init__(self, participant_id):
+        self.participant_id = participant_id
+        self.session_ref = session_ref_for(participant_id)
+        self.history_ref = history_ref_for(participant_id)
+        self._data = None
+        self._exists = None
+        self._last_seq = None
+        self._create = False
+        self._pending_fields = {}
+        self._pending_messages = []
+
+    @property
+    def exists(self):
+        return self._exists
+
+    def _load(self):
+        if self._data is None:
+            pending_fields = history_writer.pending_fields(self.participant_id)
+            with span("firestore.session.get"):
+                snapshot = self.session_ref.get()
+            self._exists = snapshot.exists or bool(pending_fields)
+            self._data = {**((snapshot.to_dict() or {}) if snapshot.exists else {}), **pending_fields}
+            if "history" not in self._data:
+                # Entries still in the write-behind buffer are past the stored history_seq
+                self._last_seq = max(self._data.get("history_seq", 0), history_writer.last_seq(self.participant_id) or 0, self._last_seq or 0)
+        return self._data
+
+    async def load(self):
+        return await asyncio.to_thread(self._load)
+
+    def get(self, field, default=None):
+        return (self._data or {}).get(field, default)
+
+    def create(self):
+        # Session defaults are written with the first commit
+        self._create = True
+        self._exists = True
+
+    def set_fields(self, **fields):
+        self._pending_fields.update(fields)
+
+    def append_messages(self, request_message, response_message):
+        self._pending_messages.append({"role": "user", "content": request_message})
+        self._pending_messages.append({"role": "assistant", "content": response_message})
+
+    def _history(self, limit=None):
+        pending = history_writer.pending_messages(self.participant_id)
+        stored = query_history(self.participant_id, limit)
+        if not stored and not pending:
+            return get_history(self.participant_id, limit=limit)
+        entries = merge_history(stored, pending)
+        # Highest seq across stored and buffered entries, so the next commit allocates after both
+        if entries and (self._data is None or "history" not in self._data):
+            self._last_seq = max(self._last_seq or 0, entries[-1]["seq"])
+        if limit:
+            entries = entries[-limit:]
+        return [{"role": entry["role"], "content": entry["content"]} for entry in entries]
+
+    async def history(self):
+        return await asyncio.to_thread(self._history)
+
+    async def recent_messages(self, limit=RECENT_MESSAGES_LIMIT):
+        try:
+            return await asyncio.to_thread(self._history, limit)
+        except Exception as e:
+            logger.warning(f"Error retrieving recent messages for participant {self.participant_id}: {e}")
+            return []
+
+    def _take_pending(self):
+        messages, fields = self._pending_messages, dict(self._pending_fields)
+        if self._create:
+            fields = {**SESSION_DEFAULTS, **fields}
+        self._pending_messages, self._pending_fields, self._create = [], {}, False
+        return messages, fields
+
+    def _commit(self, messages, fields):
+        if self._last_seq is not None:
+            seq = self._last_seq
+            entries = []
+            for message in messages:
+                seq += 1
+                entries.append({"seq": seq, **message})
+            self._last_seq = commit_history_write(self.participant_id, entries, fields) or self._last_seq
+        else:
+            self._last_seq = append_history(self.participant_id, messages, fields)
+
+    async def commit(self, once=None):
+        # With `once`, the messages are written only if no earlier commit used the
+        # same key; the key is recorded in the same write, so a background job that
+        # re-runs a stage after a crash does not append its messages twice
+        if once is not None and self._pending_messages:
+            await self.load()
+            appended = list(self.get("appended_once") or [])
+            if once in appended:
+                logger.info(f"History for {once} already written, skipping")
+                self._pending_messages = []
+            else:
+                self.set_fields(appended_once=(appended + [once])[-APPENDED_ONCE_KEPT:])
+        messages, fields = self._take_pending()
+        if not messages and not fields:
+            return
+        try:
+            if self._last_seq is None:
+                # Seed the allocator from the parent document and the write-behind buffer;
+                # it stays None only for a legacy history array, which append_history migrates
+                await self.load()
+            if history_writer.running and self._last_seq is not None:
+                # Write-behind: the response does not wait for the Firestore commit
+                self._last_seq = history_writer.enqueue(self.participant_id, self._last_seq, messages, fields)
+            else:
+                await asyncio.to_thread(self._commit, messages, fields)
+                logger.debug(f"Session committed for participant {self.participant_id}.")
+            if self._data is not None:
+                # Later reads and commits in this request see what was just written
+                self._data.update(fields)
+        except Exception as e:
+            logger.warning(f"Error storing messages for participant {self.participant_id}: {e}")
@@ -1,29 +1,27 @@
 # Google Custom Search API
 # input: subject with method (e.g., python with blogs)
-from googleapiclient.discovery import build
 import json
 import os
 import random
-cse_id = os.getenv('CSE_ID1')
-
-# Get all environment variables
-env_vars = os.environ
-env_vars_dict = dict(env_vars)
+from components.HTTP_client import get_google_client
+from components.Logger import get_logger
 
-# Filter keys that start with 'YOUTUBE_API_KEY'
-youtube_api_keys = [k for k in env_vars_dict if k.startswith("YOUTUBE_API_KEY")]
+logger = get_logger(__name__)
 
-# Sort keys by the numerical suffix
-sorted_keys = sorted(youtube_api_keys)
+cse_id = os.getenv('CSE_ID1')
 
-selected_key = random.choice(sorted_keys)
-YOUTUBE_API_KEY = os.environ[selected_key]
+def get_search_api_key():
+    # Picked per call rather than at import, so a missing key fails the request, not the app
+    youtube_api_keys = sorted(k for k in os.environ if k.startswith("YOUTUBE_API_KEY"))
+    if not youtube_api_keys:
+        raise ValueError("No YOUTUBE_API_KEY found in environment variables.")
+    return os.environ[random.choice(youtube_api_keys)]
 
 def google_search_availability(search_term):
-    service = build("customsearch", "v1", developerKey=YOUTUBE_API_KEY)
     try:
+        service = get_google_client("customsearch", "v1", get_search_api_key())
         res = service.cse().list(q=search_term, cx=cse_id, num=10, start=1).execute()
         return res.get('items', [])
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.warning(f"An error occurred: {e}")
         return []
\ No newline at end of file
@@ -0,0 +1,64 @@
+# HTTP_client.py
+# Application-lifetime HTTP layer.
+# One pooled aiohttp session serves all raw REST calls (video validation etc.),
+# and googleapiclient services are built once per (service, key) and reused so
+# discovery parsing and TLS handshakes are not repeated on every request.
+import os
+import threading
+import aiohttp
+from googleapiclient.discovery import build
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = 30
+HTTP_TIMEOUT_SECONDS = 30
+# Points Google API traffic at another host, e.g. the fake services in benchmarks/
+GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT")
+YOUTUBE_VIDEOS_URL = f"{GOOGLE_API_ENDPOINT or 'https://www.googleapis.com'}/youtube/v3/videos"
+
+_session = None
+# httplib2 (used by googleapiclient) is not thread-safe, so services are cached per thread
+_google_clients = threading.local()
+
+
+async def open_session():
+    """Create the shared session; called from the FastAPI lifespan hook."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS)
+        )
+    return _session
+
+
+async def get_session():
+    """Return the shared session, opening it lazily outside the app lifespan (scripts, workers)."""
+    if _session is None or _session.closed:
+        return await open_session()
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_google_client(service, version, api_key):
+    """Return a cached googleapiclient service for this thread and key."""
+    clients = getattr(_google_clients, "clients", None)
+    if clients is None:
+        clients = _google_clients.clients = {}
+    cache_key = (service, version, api_key)
+    if cache_key not in clients:
+        client_options = {"api_endpoint": GOOGLE_API_ENDPOINT} if GOOGLE_API_ENDPOINT else None
+        clients[cache_key] = build(service, version, developerKey=api_key, cache_discovery=False, client_options=client_options)
+    return clients[cache_key]
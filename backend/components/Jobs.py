@@ -0,0 +1,436 @@
+# Jobs.py
+# Background jobs for plan generation.
+# A full plan is several sequential LLM calls plus video validation and can run
+# for minutes, longer than a serverless request may stay open. Endpoints submit
+# a job instead and return its ID; the job runs in this process and records a
+# checkpoint in the Firestore "jobs" collection after every stage, so a job
+# whose worker disappeared can be resumed (on startup, or via the resume
+# endpoints) without repeating stages that were already paid for. Clients poll
+# the job document or subscribe to its updates.
+import asyncio
+import os
+import socket
+import time
+import uuid
+from firebase_admin import firestore
+from components.Clients import LazyCollection, get_firestore
+from components.Metrics import span, count
+from components.Logger import get_logger, bind
+
+logger = get_logger(__name__)
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# A running job whose lease has expired is treated as abandoned and may be resumed
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# The lease is renewed this often while a job runs, so a long stage never outlives it
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", str(JOB_LEASE_SECONDS / 5)))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Manual retries of a failed job, each starting a fresh set of attempts
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "3"))
+# Seconds a worker request (/jobs/resume, /jobs/{id}/resume) may spend starting new
+# stages; a stage already started always finishes, so keep this under the platform
+# timeout by the length of the slowest stage
+JOB_RUN_BUDGET_SECONDS = float(os.getenv("JOB_RUN_BUDGET_SECONDS", "120"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+RESUME_SCAN_LIMIT = 50
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobPaused(Exception):
+    """Raised by JobContext.stage when the run's time budget is spent before a new stage."""
+
+
+def public_view(job):
+    """The fields of a job document returned to clients."""
+    view = {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "stages_done": sorted(job.get("checkpoints") or {}),
+        "updated_at": job.get("updated_at"),
+    }
+    if job["status"] == DONE:
+        view["response"] = job.get("result")
+    if job["status"] == FAILED:
+        view["error"] = job.get("error")
+    return view
+
+
+class JobStore:
+    # Job documents: jobs/{job_id} with kind, params, status, stage,
+    # checkpoints {stage: value}, result/error, worker, lease_until and attempts
+    def __init__(self, collection="jobs"):
+        self.collection = LazyCollection(collection)
+
+    def create(self, kind, participant_id, params):
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "participant_id": participant_id,
+            "params": params,
+            "status": QUEUED,
+            "stage": None,
+            "checkpoints": {},
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with span("firestore.jobs.create"):
+            self.collection.require().document(job["job_id"]).set(job)
+        return job
+
+    def get(self, job_id):
+        with span("firestore.jobs.get"):
+            snapshot = self.collection.require().document(job_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def update(self, job_id, fields, lease_seconds=None):
+        fields = {**fields, "updated_at": time.time()}
+        if lease_seconds:
+            fields["lease_until"] = fields["updated_at"] + lease_seconds
+        with span("firestore.jobs.update"):
+            self.collection.require().document(job_id).update(fields)
+
+    def _transact(self, job_id, change):
+        # Runs change(job, now) -> (fields or None, result) in a transaction on the job document
+        job_ref = self.collection.require().document(job_id)
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            fields, result = change(snapshot.to_dict(), time.time())
+            if fields:
+                transaction.update(job_ref, fields)
+            return result
+
+        return run(get_firestore().transaction())
+
+    def renew(self, job_id, worker, lease_seconds):
+        """Extend the lease if `worker` still holds it; returns False if it has lost it."""
+        def change(job, now):
+            if job["status"] != RUNNING or job.get("worker") != worker:
+                return None, False
+            # Only the lease; updated_at is left alone so watchers see no change
+            return {"lease_until": now + lease_seconds}, True
+
+        with span("firestore.jobs.renew"):
+            return bool(self._transact(job_id, change))
+
+    def fail(self, job_id, worker, error):
+        """Mark a job failed unless it finished or another worker holds a live lease on it."""
+        def change(job, now):
+            if job["status"] in FINISHED:
+                return None, False
+            if job["status"] == RUNNING and job.get("worker") != worker and job.get("lease_until", 0) > now:
+                return None, False
+            return {"status": FAILED, "error": error, "updated_at": now}, True
+
+        with span("firestore.jobs.fail"):
+            return bool(self._transact(job_id, change))
+
+    def retry(self, job_id, max_retries=JOB_MAX_RETRIES):
+        """Queue a failed job again with fresh attempts; returns False if it is not failed or out of retries."""
+        def change(job, now):
+            if job["status"] != FAILED or job.get("retries", 0) >= max_retries:
+                return None, False
+            return {"status": QUEUED, "error": None, "lease_until": 0, "attempts": 0,
+                    "retries": job.get("retries", 0) + 1, "updated_at": now}, True
+
+        with span("firestore.jobs.retry"):
+            return bool(self._transact(job_id, change))
+
+    def claim(self, job_id, worker, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        # Takes the lease in a transaction, so two workers never run the same job.
+        # Returns the job if this worker now owns it, otherwise None.
+        job_ref = self.collection.require().document(job_id)
+
+        @firestore.transactional
+        def take(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            now = time.time()
+            if job["status"] in FINISHED:
+                return None
+            if job["status"] == RUNNING and job.get("lease_until", 0) > now and job.get("worker") != worker:
+                return None
+            if job.get("attempts", 0) >= max_attempts:
+                transaction.update(job_ref, {"status": FAILED, "error": "Too many attempts", "updated_at": now})
+                return None
+            fields = {"status": RUNNING, "worker": worker, "lease_until": now + lease_seconds,
+                      "attempts": job.get("attempts", 0) + 1, "updated_at": now}
+            transaction.update(job_ref, fields)
+            return {**job, **fields}
+
+        with span("firestore.jobs.claim"):
+            return take(get_firestore().transaction())
+
+    def stale_jobs(self, limit=RESUME_SCAN_LIMIT):
+        """IDs of queued or running jobs whose lease has expired."""
+        now = time.time()
+        with span("firestore.jobs.scan"):
+            snapshots = self.collection.require().where("status", "in", [QUEUED, RUNNING]).limit(limit).get()
+        return [snapshot.id for snapshot in snapshots if snapshot.to_dict().get("lease_until", 0) <= now]
+
+
+class JobContext:
+    """Handed to a job handler: its parameters, completed checkpoints and a stage runner."""
+
+    def __init__(self, runner, job, deadline=None):
+        self.runner = runner
+        self.job = job
+        # time.monotonic() after which no new stage is started (None: no limit)
+        self.deadline = deadline
+        self.stages_run = 0
+        # Set by the heartbeat when another worker has taken the job over
+        self.lease_lost = False
+        self.job_id = job["job_id"]
+        self.participant_id = job["participant_id"]
+        self.params = job.get("params") or {}
+        self.checkpoints = dict(job.get("checkpoints") or {})
+
+    async def stage(self, name, generate, store=None):
+        # Runs `generate()` unless an earlier attempt already checkpointed this
+        # stage, then `store(value)` (e.g. appending to the participant's
+        # history) unless that was recorded as done too. Returns the value.
+        saved = self.checkpoints.get(name)
+        if saved is None:
+            # At least one stage runs per call, so every worker request makes progress
+            if self.deadline is not None and self.stages_run and time.monotonic() >= self.deadline:
+                raise JobPaused(name)
+            await self.runner.update(self.job_id, {"stage": name})
+            with span(f"job.stage.{name}"):
+                value = await generate()
+            self.stages_run += 1
+            saved = {"value": value, "stored": store is None}
+            await self.checkpoint(name, saved)
+        else:
+            count("jobs.stages_resumed")
+            logger.info(f"Resuming job {self.job_id} past stage {name}")
+        if not saved["stored"]:
+            await store(saved["value"])
+            saved = {**saved, "stored": True}
+            await self.checkpoint(name, saved)
+        return saved["value"]
+
+    def history_key(self, name):
+        """Key for ParticipantSession.commit(once=...) that is unique to this job's stage."""
+        return f"{self.job_id}:{name}"
+
+    async def checkpoint(self, name, saved):
+        self.checkpoints[name] = saved
+        await self.runner.update(self.job_id, {f"checkpoints.{name}": saved, "stage": name})
+
+
+class JobRunner:
+    # Runs jobs as tasks in this process, at most `concurrency` at a time; the
+    # rest wait as "queued". Handlers are registered per job kind and receive a
+    # JobContext; whatever they return becomes the job's result.
+    def __init__(self, store, concurrency=JOB_CONCURRENCY, lease_seconds=JOB_LEASE_SECONDS):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.handlers = {}
+        self._concurrency = concurrency
+        self._semaphore = None
+        self._tasks = {}
+        # Latest state of jobs running here, so subscribers need not poll Firestore
+        self._local = {}
+        self._changed = {}
+
+    def handler(self, kind):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    async def submit(self, kind, participant_id, params):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = await asyncio.to_thread(self.store.create, kind, participant_id, params)
+        count(f"jobs.submitted.{kind}")
+        self.start(job["job_id"])
+        return job
+
+    def start(self, job_id, deadline=None):
+        """Run (or resume) a job in this process unless it is already running here."""
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            task = self._tasks[job_id] = asyncio.create_task(self._run(job_id, deadline))
+            task.add_done_callback(lambda _, job_id=job_id: self._tasks.pop(job_id, None))
+        return task
+
+    async def run(self, job_id, budget=JOB_RUN_BUDGET_SECONDS):
+        # Worker path for platforms that freeze the instance once a response is sent
+        # (serverless): drives the job inside the calling request. New stages start
+        # only within `budget` seconds; the job is then released for the next call.
+        running = self._tasks.get(job_id)
+        task = self.start(job_id, deadline=time.monotonic() + budget)
+        # A stage that started in time is awaited to its checkpoint; a job already
+        # running here has no deadline, so it is waited on only up to the budget.
+        # asyncio.wait keeps the job going if the caller disconnects.
+        await asyncio.wait({task}, timeout=budget if task is running else None)
+
+    async def retry(self, job_id):
+        # A failed job keeps its checkpoints, so a retry only repeats the stage that failed
+        if not await asyncio.to_thread(self.store.retry, job_id):
+            raise ValueError("Job cannot be retried")
+
+    async def resume_stale(self, budget=None):
+        """Start every stale job; with a budget, run them within this call (see run())."""
+        try:
+            job_ids = await asyncio.to_thread(self.store.stale_jobs)
+        except Exception as e:
+            logger.warning(f"Could not scan for stale jobs: {e}")
+            return []
+        if job_ids:
+            logger.info(f"Resuming {len(job_ids)} stale jobs")
+        if budget is None:
+            for job_id in job_ids:
+                self.start(job_id)
+        else:
+            await asyncio.gather(*(self.run(job_id, budget) for job_id in job_ids))
+        return job_ids
+
+    async def stop(self):
+        # Unfinished jobs keep their checkpoints; releasing the lease lets the
+        # next worker resume them right away instead of after it expires
+        running = list(self._local)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job_id in running:
+            try:
+                await asyncio.to_thread(self.store.update, job_id, {"status": QUEUED, "lease_until": 0})
+            except Exception as e:
+                logger.warning(f"Could not release job {job_id}: {e}")
+
+    async def _run(self, job_id, deadline=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        async with self._semaphore:
+            try:
+                job = await asyncio.to_thread(self.store.claim, job_id, self.worker, self.lease_seconds)
+            except Exception as e:
+                logger.exception(f"Could not claim job {job_id}: {e}")
+                await self._fail(job_id, "Failed to start job")
+                return
+            if job is None:
+                return
+            bind(request_id=f"job-{job_id}", participant_id=job["participant_id"])
+            self._publish(job_id, job)
+            logger.info(f"Running {job['kind']} job {job_id} (attempt {job['attempts']})")
+            context = JobContext(self, job, deadline)
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, context, asyncio.current_task()))
+            try:
+                with span(f"job.{job['kind']}"):
+                    result = await self.handlers[job["kind"]](context)
+                count("jobs.completed")
+                await self.update(job_id, {"status": DONE, "stage": None, "result": result})
+            except asyncio.CancelledError:
+                if not context.lease_lost:
+                    raise
+                # Cancelled by the heartbeat: the job belongs to another worker now, so write nothing
+                asyncio.current_task().uncancel()
+                logger.warning(f"Lost the lease on job {job_id}, stopped running it")
+                count("jobs.lease_lost")
+            except JobPaused as e:
+                logger.info(f"Job {job_id} paused before stage {e}, out of time budget")
+                await self._release(job_id)
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed: {e}")
+                count("jobs.failed")
+                await self._fail(job_id, f"Failed to generate {job['kind']} response")
+            finally:
+                heartbeat.cancel()
+                self._local.pop(job_id, None)
+
+    async def _fail(self, job_id, error):
+        try:
+            failed = await asyncio.to_thread(self.store.fail, job_id, self.worker, error)
+            if failed and job_id in self._local:
+                self._publish(job_id, {**self._local[job_id], "status": FAILED, "error": error})
+        except Exception as e:
+            logger.exception(f"Could not mark job {job_id} failed: {e}")
+
+    async def _release(self, job_id):
+        # Queued with an expired lease, so the next worker call picks it up right away
+        try:
+            await asyncio.to_thread(self.store.update, job_id, {"status": QUEUED, "lease_until": 0})
+            self._publish(job_id, {**self._local[job_id], "status": QUEUED})
+        except Exception as e:
+            logger.warning(f"Could not release job {job_id}: {e}")
+
+    async def _heartbeat(self, job_id, context, runner_task):
+        # Keeps the lease ahead of a stage that runs longer than the lease itself, and
+        # stops the run if another worker has claimed the job after the lease lapsed
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                owned = await asyncio.to_thread(self.store.renew, job_id, self.worker, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+                continue
+            if not owned:
+                context.lease_lost = True
+                runner_task.cancel()
+                return
+
+    async def update(self, job_id, fields):
+        # Every write also renews the lease
+        await asyncio.to_thread(self.store.update, job_id, fields, self.lease_seconds)
+        job = self._local.get(job_id)
+        if job is not None:
+            job = {**job, "updated_at": time.time()}
+            for key, value in fields.items():
+                if key.startswith("checkpoints."):
+                    job["checkpoints"] = {**job.get("checkpoints", {}), key.split(".", 1)[1]: value}
+                else:
+                    job[key] = value
+            self._publish(job_id, job)
+
+    def _publish(self, job_id, job):
+        self._local[job_id] = job
+        changed = self._changed.pop(job_id, None)
+        if changed is not None:
+            changed.set()
+
+    async def get(self, job_id):
+        job = self._local.get(job_id)
+        if job is not None:
+            return job
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def watch(self, job_id):
+        """Yield the job each time it changes, until it finishes."""
+        last = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            view = public_view(job)
+            if view != last:
+                last = view
+                yield job
+            if job["status"] in FINISHED:
+                return
+            if job_id in self._local:
+                changed = self._changed.setdefault(job_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=JOB_POLL_INTERVAL * 15)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Running elsewhere, or finished here a moment ago
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+job_runner = JobRunner(JobStore())
@@ -0,0 +1,124 @@
+# LLM_engine.py
+# Async OpenAI layer shared by ChatApp and the app.py endpoints.
+# Every completion goes through one AsyncOpenAI client, bounded by a semaphore
+# so a single worker can keep many generations in flight without blocking
+# the event loop.
+# Token usage is recorded per call label, including the prompt tokens the
+# provider served from its prefix cache, so cache hit rates can be watched.
+# Callers can opt deterministic (temperature-0) calls into `response_cache`,
+# which answers repeated identical requests without calling the API.
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from openai import AsyncOpenAI
+from components.Metrics import span, count
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+
+class LLMEngine:
+    def __init__(self, api_key, model=DEFAULT_MODEL, max_concurrency=None, response_cache=None):
+        self.api_key = api_key
+        self._client = None
+        self.model = model
+        self.response_cache = response_cache
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._usage = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        self._usage_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use so importing the app does not construct the HTTP client
+        if self._client is None:
+            self._client = AsyncOpenAI(api_key=self.api_key)
+        return self._client
+
+    def record_usage(self, label, usage):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        with self._usage_lock:
+            stats = self._usage[label]
+            stats["calls"] += 1
+            stats["prompt_tokens"] += usage.prompt_tokens or 0
+            stats["cached_tokens"] += cached
+            stats["completion_tokens"] += usage.completion_tokens or 0
+        count("llm.prompt_tokens", usage.prompt_tokens or 0)
+        count("llm.cached_tokens", cached)
+        count("llm.completion_tokens", usage.completion_tokens or 0)
+
+    def usage_stats(self):
+        """Token totals per label, with the share of prompt tokens served from the provider cache."""
+        with self._usage_lock:
+            stats = {label: dict(values) for label, values in self._usage.items()}
+        for values in stats.values():
+            prompt_tokens = values["prompt_tokens"]
+            values["cached_rate"] = round(values["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+        return stats
+
+    async def create(self, messages, timeout=300.0, model=None, label="default", **kwargs):
+        """Return the raw chat completion for `messages`."""
+        async with self.semaphore:
+            with span(f"llm.{label}"):
+                response = await self.client.with_options(timeout=timeout).chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    **kwargs
+                )
+        self.record_usage(label, getattr(response, "usage", None))
+        return response
+
+    def _cache_key(self, cache, messages, model, kwargs):
+        if not cache or self.response_cache is None:
+            return None
+        return self.response_cache.make_key(model or self.model, messages, **kwargs)
+
+    async def complete(self, messages, timeout=300.0, model=None, label="default", cache=False, **kwargs):
+        """Return only the text of the first choice.
+
+        With cache=True an identical earlier request is answered from `response_cache`.
+        """
+        async def fetch():
+            response = await self.create(messages, timeout=timeout, model=model, label=label, **kwargs)
+            return response.choices[0].message.content
+
+        key = self._cache_key(cache, messages, model, kwargs)
+        if key is None:
+            return await fetch()
+        return await self.response_cache.get_or_complete(key, fetch, model=model or self.model)
+
+    async def stream(self, messages, timeout=300.0, model=None, label="default", cache=False, **kwargs):
+        """Yield content deltas as they arrive from the API.
+
+        With cache=True a cached answer is yielded as a single delta, and a
+        fully streamed answer is stored for the next identical request.
+        """
+        key = self._cache_key(cache, messages, model, kwargs)
+        if key is not None:
+            cached = await self.response_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        async with self.semaphore:
+            with span(f"llm.{label}"):
+                response = await self.client.with_options(timeout=timeout).chat.completions.create(
+                    model=model or self.model,
+                    messages=messages,
+                    stream=True,
+                    # The final chunk then carries the usage for the whole stream
+                    stream_options={"include_usage": True},
+                    **kwargs
+                )
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        self.record_usage(label, chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+        if key is not None:
+            await self.response_cache.set(key, "".join(chunks), model=model or self.model)
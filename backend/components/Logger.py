@@ -0,0 +1,123 @@
+# Logger.py
+# Structured, asynchronous logging for the backend.
+# Records are formatted as one JSON object per line and written by a
+# QueueListener thread, so request handlers only enqueue. String fields are
+# truncated to LOG_PAYLOAD_LIMIT characters, high-volume records can be marked
+# `sample=True` to keep only LOG_SAMPLE_RATE of them, and full payload dumps
+# (plans, raw model output) are written only for the participant or request IDs
+# listed in DEBUG_DUMP_IDS.
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_PAYLOAD_LIMIT = int(os.getenv("LOG_PAYLOAD_LIMIT", "500"))
+EXCEPTION_LIMIT = 4000
+DEBUG_DUMP_IDS = {value.strip() for value in os.getenv("DEBUG_DUMP_IDS", "").split(",") if value.strip()}
+
+request_id_var = ContextVar("request_id", default=None)
+participant_id_var = ContextVar("participant_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_EXCEPTION_FORMATTER = logging.Formatter()
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def truncate(value, limit=LOG_PAYLOAD_LIMIT):
+    text = value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+    return text if len(text) <= limit else f"{text[:limit]}…[{len(text) - limit} more chars]"
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        full = getattr(record, "full", False)
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage() if full else truncate(record.getMessage()),
+        }
+        # Extras, including request_id/participant_id captured by ContextQueueHandler
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key in ("sample", "full") or value is None:
+                continue
+            limit = EXCEPTION_LIMIT if key == "exc" else LOG_PAYLOAD_LIMIT
+            entry[key] = value if full or isinstance(value, (int, float, bool)) else truncate(value, limit)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    # Only records marked sample=True are sampled; warnings and errors always pass
+    def filter(self, record):
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            return random.random() < LOG_SAMPLE_RATE
+        return True
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    # Formatting happens on the listener thread, where the context variables are
+    # not set, so they are captured here along with the rendered message
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+        record.exc_info = record.exc_text = None
+        record.request_id = request_id_var.get()
+        record.participant_id = participant_id_var.get()
+        return record
+
+
+def _setup():
+    root = logging.getLogger("planglow")
+    if root.handlers:
+        return root
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    return root
+
+
+def get_logger(name):
+    _setup()
+    return logging.getLogger(f"planglow.{name.rsplit('.', 1)[-1]}")
+
+
+def bind(request_id=None, participant_id=None):
+    """Attach IDs to every record logged from the current context."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if participant_id is not None:
+        participant_id_var.set(participant_id)
+
+
+def dump_enabled():
+    return bool(DEBUG_DUMP_IDS) and (request_id_var.get() in DEBUG_DUMP_IDS or participant_id_var.get() in DEBUG_DUMP_IDS)
+
+
+def debug_dump(logger, message, payload):
+    """Log the full, untruncated payload, only for IDs listed in DEBUG_DUMP_IDS."""
+    if dump_enabled():
+        logger.info(message, extra={"payload": payload, "full": True})
+
+
+def new_request_id():
+    return f"{int(time.time() * 1000):x}-{random.getrandbits(32):08x}"
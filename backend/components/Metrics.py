@@ -0,0 +1,141 @@
+# Metrics.py
+# Latency spans and counters for the LLM, YouTube and Firestore stages.
+# span() times a block and feeds a process-wide histogram per span name;
+# count() adds to a counter (tokens, quota units). Both are also attributed to
+# the current request's trace, which the app middleware logs as one JSON line
+# per request. snapshot() backs the /metrics endpoint.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from components.Logger import get_logger
+
+SAMPLE_WINDOW = 1000
+logger = get_logger(__name__)
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class _Histogram:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # Recent samples only, for percentiles
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def add(self, duration_ms, error):
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.samples.append(duration_ms)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class Trace:
+    """Spans and counters collected while serving one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, duration_ms):
+        with self._lock:
+            calls, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (calls + 1, total + duration_ms)
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self, **fields):
+        return {
+            "trace": self.name,
+            **fields,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "spans": {name: {"calls": calls, "ms": round(total, 1)} for name, (calls, total) in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration_ms, error=False):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = _Histogram()
+            histogram.add(duration_ms, error)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, duration_ms)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_count(name, value)
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, error)
+
+    def snapshot(self):
+        with self._lock:
+            spans = {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {"spans": spans, "counters": counters}
+
+
+metrics = MetricsRegistry()
+span = metrics.span
+count = metrics.count
+
+
+def start_trace(name):
+    """Attach a new trace to the current context; returns (trace, token) for end_trace."""
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def log_trace(trace, **fields):
+    # One structured line per request; plans and messages are never included, so nothing is truncated
+    logger.info("request", extra={**trace.as_dict(**fields), "full": True})
@@ -1,17 +1,26 @@
-from openai import OpenAI
+import asyncio
 import sys
 import os
 import json
 import time
 import re
-import firebase_admin
-from firebase_admin import credentials, firestore
-db = firestore.client()
+from components.LLM_engine import LLMEngine
+from components.Conversation_store import ConversationStore
+from components.Database import get_history
+from components.Context_builder import ChatContextBuilder
+from components import Prompts
+from components.Study_plan import PLAN_RESPONSE_FORMAT, parse_study_plan, plan_text
+from components.Logger import get_logger, debug_dump
+
+logger = get_logger(__name__)
 
 class ChatApp:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
-        self.messages = [
+    def __init__(self, api_key=None, llm=None):
+        self.llm = llm or LLMEngine(api_key=api_key)
+        # Per-participant history; the system prompt is shared and never stored per user
+        self.conversations = ConversationStore()
+        self.context_builder = ChatContextBuilder(self.llm)
+        self.system_messages = [
             {"role": "system", 
             "content": (
                     "You are an intelligent assistant specializing in creating metacognition-driven, customized, and detailed study plans tailored to user-specific requirements. \
@@ -59,88 +68,63 @@ class ChatApp:
             }
         ]
 
-    def generate_response(self, prompt, **kwargs):
+    async def generate_response(self, prompt, on_token=None, **kwargs):
+        # on_token: optional callback receiving each partial token as it streams in
         try:
-            response = self.client.with_options(timeout=300.0).chat.completions.create(
-                model="gpt-4o",
-                messages=prompt,
-                **kwargs
-            )
-            response_text = response.choices[0].message.content
-            print("API response:", response_text)
+            if on_token is None:
+                response_text = await self.llm.complete(prompt, timeout=300.0, **kwargs)
+            else:
+                chunks = []
+                async for token in self.llm.stream(prompt, timeout=300.0, **kwargs):
+                    chunks.append(token)
+                    on_token(token)
+                response_text = "".join(chunks)
+            debug_dump(logger, "API response", response_text)
             return response_text
         except Exception as e:
-            print(f"OpenAI API error: {e}")
+            logger.exception(f"OpenAI API error: {e}")
             return None
 
 
-    def chat(self, message):
-        self.messages.append({"role": "user", "content": message})
+    async def chat(self, message, participant_id, on_token=None):
+        self.conversations.append(participant_id, "user", message)
         # Step 1: initial response
-        initial_response = self.generate_response(
-            prompt=self.messages,
+        initial_response = await self.generate_response(
+            prompt=self.system_messages + self.conversations.window(participant_id),
+            on_token=on_token,
             temperature=0.0,
             top_p=0.8,
             frequency_penalty=0.2,
-            presence_penalty=0.1
+            presence_penalty=0.1,
+            response_format=PLAN_RESPONSE_FORMAT,
+            label="chat"
         )
         if initial_response:
-            json_match = re.search(r'```json([\s\S]*?)```', initial_response)
-            if json_match:
-                json_text = json_match.group(1).strip()
-                try:
-                    parsed_json = json.loads(json_text)
-                    print("Parsed JSON response:", parsed_json)
-                    return parsed_json
-                except json.JSONDecodeError:
-                    print("JSON parsing error. Returning raw response.")
-                    return initial_response
-            else:
-                print("No JSON block found, returning raw response.")
-                return initial_response  
+            self.conversations.append(participant_id, "assistant", initial_response)
+            parsed_json = parse_study_plan(initial_response)
+            if parsed_json is None:
+                logger.warning("Response is not a valid study plan, returning raw response.")
+                return initial_response
+            return parsed_json
         else:
             return {"error": "An error occurred while generating the response."} 
 
 
     # step 2 critique
-    def get_critique_response(self, parsed_json):
-        critique_prompt = [
-            {"role": "system", "content": "You are a study plan evaluator.\n"
-            f"Here's my initial study plan response: {parsed_json}. \n"
-            "Evaluate this plan by focusing on the following criteria:\
-                1. Knowles’ Five Assumptions of Adult Learners: Knowles theory of andragogy identified five assumptions that teachers should make about adult learners.\
-                    1) Self-Concept – Because adults are at a mature developmental stage, they have a more secure self-concept than children. This allows them to take part in directing their own learning.\
-                    2) Past Learning Experience – Adults have a vast array of experiences to draw on as they learn, as opposed to children who are in the process of gaining new experiences.\
-                    3) Readiness to Learn – Many adults have reached a point in which they see the value of education and are ready to be serious about and focused on learning.\
-                    4) Practical Reasons to Learn – Adults are looking for practical, problem-centered approaches to learning. Many adults return to continuing education for specific practical reasons, such as entering a new field.\
-                    5) Driven by Internal Motivation – While many children are driven by external motivators – such as punishment if they get bad grades or rewards if they get good grades – adults are more internally motivated.\
-                2. Four Principles of Andragogy: Based on these assumptions about adult learners, Knowles discussed four principles that  educators should consider when teaching adults.\
-                    1) Since adults are self-directed, they should have a say in the content and process of their learning.\
-                    2) Because adults have so much experience to draw from, their learning should focus on adding to what they have already learned in the past.\
-                    3) Since adults are looking for practical learning, content should focus on issues related to their work or personal life.\
-                    4) Additionally, learning should be centered on solving problems instead of memorizing content.\
-                3. The following are proposed as the components of an ideal study guide assignment(Duchastel, P. (1983). Toward the ideal study guide: An exploration of the functions and components of study guides. British Journal of Educational Technology, 14(3), 216-231.):\
-                    1) Purpose, significance, and goals\
-                    2) Text references\
-                    3) Outline of the subject matter\
-                    4) Questions on the subject matter\
-                    5) Key words and phrases\
-                    6) Application problem\
-                    7) Assignment test"
-            "Provide actionable and constructive feedback addressing these areas. Keep the critique concise but specific, highlighting the most critical improvements needed. Avoid unnecessary elaboration or repetition."
-            }
-        ]
+    async def get_critique_response(self, parsed_json, on_token=None):
+        # Static criteria first, the plan last, so the prefix stays cacheable
+        critique_prompt = Prompts.critique_messages(parsed_json)
         try:
-            critique_text = self.generate_response(critique_prompt, temperature=0.0)
-            print("Critique response:", critique_text)
+            critique_text = await self.generate_response(critique_prompt, on_token=on_token, temperature=0.0, label="critique", cache=True)
+            debug_dump(logger, "Critique response", critique_text)
             return critique_text
         except Exception as e:
-            print(f"Error during critique generation: {e}")
+            logger.exception(f"Error during critique generation: {e}")
             return "An error occurred while generating the critique."
 
     # step 3 improved response
-    def get_improved_response(self, user_message, parsed_json, critique_response):
-        parsed_json_str = json.dumps(parsed_json)
+    async def get_improved_response(self, user_message, parsed_json, critique_response, on_token=None):
+        parsed_json_str = plan_text(parsed_json)
         critique_str = critique_response.strip()
         improvement_prompt = [
         {
@@ -185,46 +169,39 @@ class ChatApp:
         }
     ]
         try:
-            response = self.generate_response(improvement_prompt, temperature=0.0)
+            response = await self.generate_response(improvement_prompt, on_token=on_token, temperature=0.0, response_format=PLAN_RESPONSE_FORMAT, label="improved")
+            if response is None:
+                return None
 
-            # Search for JSON in the response (in case it's wrapped in code blocks)
-            json_match = re.search(r'```json([\s\S]*?)```', response)
-            if json_match:
-                json_text = json_match.group(1).strip()
-            else:
-                # If no code block is found, assume the entire response is the JSON text
-                json_text = response.strip()
-
-            # Parse the JSON response
-            try:
-                improved_json = json.loads(json_text)
-                print("Parsed JSON improved response:", improved_json)
-                return json.dumps(improved_json)
-            except json.JSONDecodeError:
-                print("JSON parsing error. Returning raw response.")
+            # Parsed once here; the dict goes straight on to video validation
+            improved_json = parse_study_plan(response)
+            if improved_json is None:
+                logger.warning("Improved response is not a valid study plan. Returning raw response.")
                 return response
+            return improved_json
 
         except Exception as e:
-            print(f"Error during improved response generation: {e}")
+            logger.exception(f"Error during improved response generation: {e}")
             return "An error occurred while generating the improved response."
 
-    def chat_response(self, user_chat, participantId):
+    async def chat_response(self, user_chat, participantId, on_token=None, conversation_history=None):
         # json match -> critique -> get_improved_response
         # else: markdown
+        # conversation_history: pass it in when the caller has already loaded it this request
         try:
-            session_ref = db.collection("messages").document(participantId)
-            session_data = session_ref.get().to_dict() if session_ref.get().exists else {}
-            conversation_history = session_data.get("history", [])
-            history_as_text = "\n".join([f"{entry['role']}: {entry['content']}" for entry in conversation_history]) if conversation_history else "No conversation history available."
+            if conversation_history is None:
+                conversation_history = await asyncio.to_thread(get_history, participantId)
+            # Latest plan in full, recent turns within the token budget, older turns summarized
+            history_as_text = await self.context_builder.build(participantId, conversation_history)
         except Exception as e:
-            print(f"Error retrieving session data for {participantId}: {e}")
+            logger.warning(f"Error retrieving session data for {participantId}: {e}")
             conversation_history = []
             history_as_text = "Unable to retrieve conversation history."
 
         system_prompt = (
             "You are a helpful assistant tasked with guiding the user toward a comprehensive study plan."
             "Follow the user's request carefully. "
-            f"Here is the full conversation history for this user:\n{history_as_text}\n"
+            f"Here is the conversation history for this user:\n{history_as_text}\n"
             "If the user asks a general question, provide a direct and helpful answer using Markdown, instead of JSON format."
             "ELSE If the user wants to fix or improve the current plan, your output should be in JSON format, structured as follows:\n\n"
             "{\
@@ -259,56 +236,32 @@ class ChatApp:
         ]
        
         try:
-            response = self.generate_response(
+            response = await self.generate_response(
                 prompt=full_prompt, 
+                on_token=on_token,
                 temperature=0.0, 
                 top_p=0.8, 
                 frequency_penalty=0.2, 
-                presence_penalty=0.1)
-            print("Initial response received:", response)
+                presence_penalty=0.1,
+                label="chat_response")
+            debug_dump(logger, "Chat response received", response)
 
             # Check user intent
             if "improve" in user_chat.lower() or "fix" in user_chat.lower() or "update" in user_chat.lower() or "change" in user_chat.lower() or "revise" in user_chat.lower():
-                # Process JSON responses for improvement
-                json_match = re.search(r'```json([\s\S]*?)```', response)
-                if json_match:
-                    json_text = json_match.group(1).strip()
-                    try:
-                        parsed_json = json.loads(json_text)
-                        print("Parsed JSON response:", parsed_json)
-
-                        # Proceed to critique
-                        critique = self.get_critique_response(parsed_json)
-                        print("Critique response:", critique)
-
-                        # Proceed to improvement
-                        improved_response = self.get_improved_response(user_chat, parsed_json, critique)
-                        print("Improved response:", improved_response)
-
-                        return improved_response
-                    except json.JSONDecodeError:
-                        print("JSON parsing error. Proceeding with raw JSON for critique.")
-                        critique = self.get_critique_response(json_text)
-                        print("Critique response for raw JSON:", critique)
-
-                        # Proceed to improvement
-                        improved_response = self.get_improved_response(user_chat, json_text, critique)
-                        print("Improved response from raw JSON:", improved_response)
-
-                        return improved_response
-                else:
-                    print("No JSON block found. Proceeding with raw response.")
-                    critique = self.get_critique_response(response)
-                    print("Critique response for raw response:", critique)
+                # Process JSON responses for improvement; raw text goes on as is if it is not a plan
+                parsed_json = parse_study_plan(response)
+                plan = parsed_json if parsed_json is not None else response
 
-                    improved_response = self.get_improved_response(user_chat, response, critique)
-                    print("Improved response from raw response:", improved_response)
+                # Proceed to critique
+                critique = await self.get_critique_response(plan)
 
-                    return improved_response
+                # Proceed to improvement
+                improved_response = await self.get_improved_response(user_chat, plan, critique)
+                return improved_response
             else:
                 # General question, return response as Markdown
                 return response
 
         except Exception as e:
-            print(f"Unexpected error during chat response: {e}")
+            logger.exception(f"Unexpected error during chat response: {e}")
             return {"error": "An unexpected error occurred.", "details": str(e)}
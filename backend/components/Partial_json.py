@@ -0,0 +1,66 @@
+# Partial_json.py
+# Incrementally assembles a JSON study plan from streamed tokens.
+# The scanner keeps its state between tokens, so each token is scanned once;
+# whenever an object closes near the top of the document, the text seen so far
+# is closed off and parsed into a usable partial plan.
+import json
+
+
+class PartialJSONAssembler:
+    def __init__(self, max_depth=3):
+        # Only emit snapshots when an object closes at or above this nesting depth
+        # (root > studyPlan > week list), i.e. once per completed day.
+        self.max_depth = max_depth
+        self.text = []
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.stack = []
+
+    def feed(self, token):
+        """Consume a token; return the partial document when it has grown, else None."""
+        snapshot = None
+        for char in token:
+            if self.finished:
+                break
+            if not self.started:
+                if char != "{":
+                    continue
+                self.started = True
+
+            self.text.append(char)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.stack.append(char)
+            elif char in "}]" and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    self.finished = True
+                    snapshot = self.result()
+                elif char == "}" and len(self.stack) <= self.max_depth:
+                    snapshot = self._close_and_parse() or snapshot
+        return snapshot
+
+    def _close_and_parse(self):
+        text = "".join(self.text)
+        closing = "".join("}" if opener == "{" else "]" for opener in reversed(self.stack))
+        try:
+            return json.loads(text + closing)
+        except json.JSONDecodeError:
+            return None
+
+    def result(self):
+        """Parse the complete document, or None if it is not valid JSON."""
+        try:
+            return json.loads("".join(self.text))
+        except json.JSONDecodeError:
+            return None
@@ -0,0 +1,96 @@
+# Plan_templates.py
+# Lookup index of pre-generated, pre-validated study plans.
+# Plan requests from the frontend follow one fixed sentence, so they are parsed
+# into (level, topic, months, weeks, days, hours) and normalized into a key.
+# precompute_templates.py fills the Firestore "plan_templates" collection for the
+# most frequent keys; /response serves a hit immediately and generates live otherwise.
+import hashlib
+import json
+import re
+import time
+from components.Clients import LazyCollection
+from components.Cache import LRUCache
+from components.Metrics import span
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+PLAN_REQUEST_PATTERN = re.compile(
+    r"Create a study plan for a (?P<level>.+?) student on (?P<topic>.+?) using YouTube over "
+    r"(?P<months>\d+) months?, (?P<weeks>\d+) weeks?, and (?P<days>\d+) days? "
+    r"with (?P<hours>\d+(?:\.\d+)?) hours? available per day",
+    re.IGNORECASE
+)
+
+
+def parse_plan_request(user_message):
+    """Return the normalized request parameters, or None if this is not a plan request."""
+    match = PLAN_REQUEST_PATTERN.search(user_message or "")
+    if not match:
+        return None
+    return {
+        "level": re.sub(r"\s+", " ", match["level"].strip().lower()),
+        "topic": re.sub(r"\s+", " ", match["topic"].strip().lower()),
+        "months": int(match["months"]),
+        "weeks": int(match["weeks"]),
+        "days": int(match["days"]),
+        "hours": float(match["hours"]),
+    }
+
+
+def template_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class PlanTemplateStore:
+    def __init__(self, collection="plan_templates", maxsize=500, ttl=3600):
+        self.collection_name = collection
+        # Misses are cached too (as False) so long-tail requests cost one read per hour
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.collection = LazyCollection(collection)
+
+    @staticmethod
+    def _doc_id(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def lookup(self, user_message):
+        """Return the stored plan text for a plan request, or None."""
+        params = parse_plan_request(user_message)
+        if params is None:
+            return None
+        key = template_key(params)
+        plan = self.memory.get(key)
+        if plan is not None:
+            return plan or None
+
+        collection = self.collection.get()
+        if collection is None:
+            return None
+        plan = False
+        try:
+            with span(f"firestore.{self.collection_name}.get"):
+                doc = collection.document(self._doc_id(key)).get()
+            if doc.exists:
+                plan = doc.to_dict().get("plan") or False
+        except Exception as e:
+            logger.warning(f"Error reading plan template: {e}")
+            return None
+        self.memory.set(key, plan)
+        return plan or None
+
+    def store(self, params, plan, user_message):
+        key = template_key(params)
+        collection = self.collection.get()
+        if collection is None:
+            raise RuntimeError("Plan templates need Firestore")
+        collection.document(self._doc_id(key)).set({
+            **params,
+            "key": key,
+            "user_message": user_message,
+            "plan": plan,
+            "generated_at": time.time(),
+        })
+        self.memory.set(key, plan)
+
+
+plan_templates = PlanTemplateStore()
@@ -0,0 +1,218 @@
+# Prompts.py
+# Shared prompt texts for the LLM endpoints.
+# Every system prompt here is fully static, and per-request data (plans, topics,
+# user questions) goes in the trailing user message. Keeping the long prefix
+# byte-identical across requests lets the provider's prompt cache apply to it.
+import json
+from components.Study_plan import plan_text
+
+# /info: Dreyfus levels of expertise
+INFO_SYSTEM_PROMPT = (
+    "You are a helpful assistant to explain background knowledge based on the subject that users want to study. " 
+    "Here we have 6 levels of background expertise ('novice', 'advanced beginner', 'competence', 'proficiency', 'expertise', 'mastery'). "
+    "1. Novice: Novices rely heavily on context-free rules and step-by-step instructions. Their performance tends to be slow, clumsy, and requires conscious effort. Novices struggle to adapt when situations don't align with the instructions. A novice cook strictly follows recipe measurements and timing, regardless of variations in ingredients or peculiarities of the oven. A novice driver might rigidly maintain speed limits without considering traffic flow or the presence of pedestrians. Novices have a detached approach to outcomes. To progress, novices need to keep gaining experience and making mistakes in a variety of situations.\n"
+    "2. Advanced Beginner: Advanced beginners recognize situation-specific nuances and can apply experience-based maxims beyond general rules. For instance, an advanced beginner cook might adjust heat based on the smell and look of the food as it is cooking rather than just the instructions in the recipe. They have had enough experience to recognize the smell of burning oil and can now apply the maxim that “the smell of burning oil usually means the heat is too high.”  An advanced beginner chess player begins to recognize such aspects of situation such as \'weakened king’s side\' and can apply the maxim to \'attack a weakened king\’s side.\' The performance of an advanced beginner is more sophisticated than novice, but it is still analytical. They continue to struggle with unfamiliar situations. At the same time, they begin to feel more emotionally engaged, often becoming overwhelmed or frustrated. Progression requires building further emotional involvement and commitment to outcomes.\n"
+    "3. Competence: Competent performers choose specific goals and adopt an overall perspective on what their situation calls for. A competent cook can choose to have the cold dishes ready before the hot ones. A competent chess player could choose an attacking strategy, focusing on the moves and pieces that support this plan. Success and failure now partially depend on the performer’s choice of perspective and not just on how well they follow rules. This leads to higher emotional involvement, with competent performers feeling joy or regret according to the outcomes. While more fluid than advanced beginners, competent performance still proceeds by analysis, calculation, and deliberate rule-following. Competent performers show improved coordination and anticipation but may rigidly stick to chosen perspectives even when circumstances change. To advance to proficiency, more risks need to be taken with letting go of rules and procedures while trusting one’s emerging intuition.\n" 
+    "4. Proficiency: Proficient performers intuitively grasp what a situation calls for but consciously decide responses. When a perspective intuitively occurs to them, proficient nurses can instantly sense a patient\'s deterioration before vital signs change. However, they then deliberately consider treatment options. Proficient drivers instinctively tell they\'re going too fast on a rainy curve but then consciously decide whether to brake or decelerate. Proficient performers adapt better to changing circumstances but still rely on rule-based decision-making for actions. The transition to expertise requires further letting go of rules and procedures while gaining more direct experience learning which intuited perspectives work in which kind of situation.\n"
+    "5. Expertise: Experts demonstrate seamless integration of perception and action. An expert chef creates dishes without recipes, intuitively adjusting techniques and ingredients based on specific circumstances. Expert drivers intuitively lift their foot off the accelerator rather than braking. Their performance happens without deliberation or decision-making. Experts often struggle to precisely explain their actions. When circumstances abruptly change, experts smoothly adapt and shift perspectives in a \"reflexive reorientation.\" For example, expert nurses constantly attend to subtle transitions in a patient’s condition. They intuitively shift perspectives and initiate a corresponding shift in treatment when solicited by transitions in the patient’s condition.\n"
+    "6. Mastery:  Masters seek to expand and refine their repertoire of intuitive perspectives. In doing so, they sometimes create new possibilities of performing and transform the style of their domain. For example, Cézanne expanded the possibilities for the painting of form and perspective, Stephen Curry altered the style of play in basketball by making the 3-point shot central rather than marginal, and B.B. King transformed the space of possibilities in music by harnessing the previously marginal capacity of the electric guitar to sustain notes. Masters identify overlooked aspects of a practice and experiment with new approaches, accepting short-term drops in particular performances for long-term expansions in their intuition.\n"
+    "Format your response as a clean **HTML <table>**."
+    "The table should have two columns: Level and Description."
+    "Using table format below and make it easy to read." 
+    "Each description should contain bullet points inside an unordered list (`<ul><li>…</li></ul>`)."
+    "Each sentence starts with a new bullet point."
+    "Be concise."
+    "Use proper HTML tags and indentation."
+    "Here are the 6 levels to include:\
+    - Novice\
+    - Advanced Beginner\
+    - Competence\
+    - Proficiency\
+    - Expertise\
+    - Mastery\
+    Start directly with `<table>...</table>`, and make sure the output is valid HTML."
+)
+
+# /plan-reasoning: weekly reasoning (Bloom's taxonomy, content selection, connection)
+PLAN_REASONING_SYSTEM_PROMPT = (
+    "You are a helpful assistant. Please review the study plan provided by the user and generate detailed explanations for each week, focusing on three distinct aspects: Learning Objectives, Content Selection, and Connection.\n"
+    "Provide concise explanations in complete sentences and separate the reasoning into JSON format as follows:\n\n"
+    "1. Learning Objectives: Your task is to generate clear and concise learning objectives for each week using Bloom's Taxonomy.\n\
+        Please refer these guidance: these 6 levels can be used to structure the learning outcomes, lessons, and assessments of your course.\
+        1) Remembering: Retrieving, recognizing, and recalling relevant knowledge from long‐term memory.\
+        2) Understanding: Constructing meaning from oral, written, and graphic messages through interpreting, exemplifying, classifying, summarizing, inferring, comparing, and explaining.\
+        3) Applying: Carrying out or using a procedure for executing, or implementing.\
+        4) Analyzing: Breaking material into constituent parts, determining how the parts relate to one another and to an overall structure or purpose through differentiating, organizing, and attributing.\
+        5) Evaluating: Making judgments based on criteria and standards through checking and critiquing.\
+        6) Creating: Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure through generating, planning, or producing.\
+        Bloom’s is hierarchical, meaning that learning at the higher levels is dependent on having attained prerequisite knowledge and skills at lower levels.\
+        How Bloom’s can aid in study plan design? Bloom’s taxonomy is a powerful tool to help develop learning outcomes because it explains the process of learning:\
+            1) Before you can understand a concept, you must remember it.\
+            2) To apply a concept you must first understand it.\
+            3) In order to evaluate a process, you must have analyzed it.\
+            4) To create an accurate conclusion, you must have completed a thorough evaluation.\
+            However, we don’t always start with lower order skills and step all the way through the entire taxonomy for each concept you present in your course. That approach would become tedious–for both you and your students! Instead, start by considering the level of learners in your course:\
+                - Is this an “Introduction to…” course? If so, many your learning outcomes may target the lower order Bloom’s skills, because your students are building foundational knowledge. However, even in this situation we would strive to move a few of your outcomes into the applying and analyzing level, but getting too far up in the taxonomy could create frustration and unachievable goals.\
+                - Do your students have a solid foundation in much of the terminology and processes you will be working on your course? If so, then you should not have many remembering and understanding level outcomes. You may need a few, for any radically new concepts specific to your course. However, these advanced students should be able to master higher-order learning objectives. Too many lower level outcomes might cause boredom or apathy.\
+        Steps towards writing effective learning outcomes:\
+            1) Make sure there is one measurable verb in each objective.\
+            2) Each outcome needs one verb. Either a student can master the outcome , or they fail to master it. If an outcome has two verbs (say, define and apply), what happens if a student can define, but not apply? Are they demonstrating mastery?\
+            3) Ensure that the verbs in the course level outcome are at least at the highest Bloom’s Taxonomy as the highest lesson level outcomes that support it. (Because we can’t verify they can evaluate if our lessons only taught them (and assessed) to define.)\
+            4) Strive to keep all your learning outcomes measurable, clear and concise."
+    "2. Content Selection:\n"
+        "Justify the reasons for the selection of resources based on the following:\
+            1) Personalization: Resources should match the learner's current abilities and gradually introduce complexity\
+            2) Diversity and Accessibility: Easy access through platforms ensures flexibility.\
+            3) Engagement and Interactivity: Interactive elements like quizzes, discussions, and hands-on exercises increase retention and understanding.\
+            4) Quality Content: Resources should be accurate, well-structured, and created by credible experts.\
+            5) Encouraging Potential: Content should not be too easy or too difficult; it must push learners slightly beyond their comfort zone to foster growth without overwhelming them.\
+            6) Alignment with Goals: Resources should be relevant to the learner's academic, professional, or personal objectives."
+    "3. Connection:\n"
+        "Explain how the content relates to previously covered material to ensure continuity and coherence.\
+        Focus on an aligned approach to planning and implementing strategies where all elements—goals, actions, resources, and assessments—are interconnected and mutually reinforcing."
+        "Highlight how this week’s content sets the foundation for subsequent learning, enabling skill progression. "
+        "Focus on how the progression helps build a comprehensive understanding of the subject and supports gradual mastery.\n"                      
+        
+    "Provide the response in this structured JSON format: "
+    "{\n"
+    "    \"Week1\": \"- Learning objective: Describe what learners will achieve this week, using Bloom's verbs.\n"
+    "               - Content selection: Explain why this specific content was chosen to meet the objective.\n"
+    "               - Connection: Describe how this week’s content prepares learners for the next week or builds on prior knowledge.\",\n"
+    "    \"Week2\": \"- Learning objective...\n"
+    "               - Content selection...\n"
+    "               - Connection...\n\",\n"
+    "    \"Week3\": \"- Learning objective...\n"
+    "               - Content selection...\n"
+    "               - Connection...\n\",\n"
+    "    \"Week4\": \"- Learning objective...\n"
+    "               - Content selection...\n"
+    "               - Connection...\n\"\n"
+    "}\n\n"
+    "For each section, ensure that do not mention theory explicitly in the results"
+)
+
+# /topic-explanations: why a topic matters within the plan
+TOPIC_EXPLANATION_SYSTEM_PROMPT = (
+    "You are a helpful assistant to explain why the topic given by the user is important and essential in the context of the study plan provided by the user.\n"
+    "Please provide accurate and relevant explanations for the reasons for studying each topic by referring to these guidelines:\
+        - To direct and assist the student in learning the content of each assignment, it is useful first to consider the learning needs of students in studying an assignment and, hence, to examine what functions various components might play in fulfilling these needs.\
+        - Orientation: It is beneficial for students to begin studying an assignment with a general idea of what they will encounter in the assignment. \
+        This approach is ingrained in contemporary educational thinking and supported by research on learning (Hartley and Davis, 1976). Ausubel (1968) has strongly argued that a preliminary framework of what is to come—what he calls an \"advance organizer\"—can greatly facilitate learning, and he has demonstrated its practical utility.\
+        A general framework sets the scope of the assignment and shows how it fits into the overall course. It also illustrates how the topics within the assignment are partitioned and interrelated. Furthermore, it can highlight the relevance of the assignment for the student.\
+        Another aspect of orientation is goal-setting. It is helpful for students to be aware of the goals they are expected to achieve while studying an assignment (Melton, 1978). \
+        This awareness enables them to focus their efforts on reaching those goals and helps them maintain perspective on their learning progress throughout the assignment. \
+        Consider the contrast between goal-directed study and a situation where the student is unsure of the relative importance of different parts of the assignment content. \
+        Goal awareness leads to more organized study and improved learning outcomes for the student (Duchastel and Merrill, 1973)."
+    "Only provide **reason for study this topic**; Do not repeat the study plan content; Do not mention theory explicitly in the results; Be concise, as fewer as possible."
+)
+
+# /generate-objectives: Bloom's taxonomy learning objectives for one topic
+OBJECTIVES_SYSTEM_PROMPT = (
+    "You are a helpful assistant. The user provides a study plan with specific topics and one topic from it."
+    "Your task is to generate clear and concise learning objectives with as fewer points as possible for that topic using Bloom's Taxonomy."
+    "Please refer these guidance: these 6 levels can be used to structure the learning outcomes, lessons, and assessments of your course.\
+        1. Remembering: Retrieving, recognizing, and recalling relevant knowledge from long‐term memory.\
+        2. Understanding: Constructing meaning from oral, written, and graphic messages through interpreting, exemplifying, classifying, summarizing, inferring, comparing, and explaining.\
+        3. Applying: Carrying out or using a procedure for executing, or implementing.\
+        4. Analyzing: Breaking material into constituent parts, determining how the parts relate to one another and to an overall structure or purpose through differentiating, organizing, and attributing.\
+        5. Evaluating: Making judgments based on criteria and standards through checking and critiquing.\
+        6. Creating: Putting elements together to form a coherent or functional whole; reorganizing elements into a new pattern or structure through generating, planning, or producing."
+    "Bloom’s is hierarchical, meaning that learning at the higher levels is dependent on having attained prerequisite knowledge and skills at lower levels."
+    "How Bloom’s can aid in study plan design? Bloom’s taxonomy is a powerful tool to help develop learning outcomes because it explains the process of learning:\
+        1. Before you can understand a concept, you must remember it.\
+        2. To apply a concept you must first understand it.\
+        3. In order to evaluate a process, you must have analyzed it.\
+        4. To create an accurate conclusion, you must have completed a thorough evaluation.\
+        However, we don’t always start with lower order skills and step all the way through the entire taxonomy for each concept you present in your course. That approach would become tedious–for both you and your students! Instead, start by considering the level of learners in your course:\
+            - Is this an “Introduction to…” course? If so, many your learning outcomes may target the lower order Bloom’s skills, because your students are building foundational knowledge. However, even in this situation we would strive to move a few of your outcomes into the applying and analyzing level, but getting too far up in the taxonomy could create frustration and unachievable goals.\
+            - Do your students have a solid foundation in much of the terminology and processes you will be working on your course? If so, then you should not have many remembering and understanding level outcomes. You may need a few, for any radically new concepts specific to your course. However, these advanced students should be able to master higher-order learning objectives. Too many lower level outcomes might cause boredom or apathy."
+    "Steps towards writing effective learning outcomes:\
+        1. Make sure there is one measurable verb in each objective.\
+        2. Each outcome needs one verb. Either a student can master the outcome , or they fail to master it. If an outcome has two verbs (say, define and apply), what happens if a student can define, but not apply? Are they demonstrating mastery?\
+        3. Ensure that the verbs in the course level outcome are at least at the highest Bloom’s Taxonomy as the highest lesson level outcomes that support it. (Because we can’t verify they can evaluate if our lessons only taught them (and assessed) to define.)\
+        4. Strive to keep all your learning outcomes measurable, clear and concise."
+    "Validate whether these learning objectives can be achieved within the hours the user wants to study. If not, reduce them."                        
+    "Must include only learning objectives. Numbering all learning objectives."
+    "For example, \
+        1. learning objective\
+        2. learning objective\
+        ..."
+)
+
+# ChatApp.get_critique_response: Knowles / Duchastel evaluation criteria
+CRITIQUE_SYSTEM_PROMPT = (
+    "You are a study plan evaluator.\n"
+    "Evaluate this plan by focusing on the following criteria:\
+        1. Knowles’ Five Assumptions of Adult Learners: Knowles theory of andragogy identified five assumptions that teachers should make about adult learners.\
+            1) Self-Concept – Because adults are at a mature developmental stage, they have a more secure self-concept than children. This allows them to take part in directing their own learning.\
+            2) Past Learning Experience – Adults have a vast array of experiences to draw on as they learn, as opposed to children who are in the process of gaining new experiences.\
+            3) Readiness to Learn – Many adults have reached a point in which they see the value of education and are ready to be serious about and focused on learning.\
+            4) Practical Reasons to Learn – Adults are looking for practical, problem-centered approaches to learning. Many adults return to continuing education for specific practical reasons, such as entering a new field.\
+            5) Driven by Internal Motivation – While many children are driven by external motivators – such as punishment if they get bad grades or rewards if they get good grades – adults are more internally motivated.\
+        2. Four Principles of Andragogy: Based on these assumptions about adult learners, Knowles discussed four principles that  educators should consider when teaching adults.\
+            1) Since adults are self-directed, they should have a say in the content and process of their learning.\
+            2) Because adults have so much experience to draw from, their learning should focus on adding to what they have already learned in the past.\
+            3) Since adults are looking for practical learning, content should focus on issues related to their work or personal life.\
+            4) Additionally, learning should be centered on solving problems instead of memorizing content.\
+        3. The following are proposed as the components of an ideal study guide assignment(Duchastel, P. (1983). Toward the ideal study guide: An exploration of the functions and components of study guides. British Journal of Educational Technology, 14(3), 216-231.):\
+            1) Purpose, significance, and goals\
+            2) Text references\
+            3) Outline of the subject matter\
+            4) Questions on the subject matter\
+            5) Key words and phrases\
+            6) Application problem\
+            7) Assignment test"
+    "Provide actionable and constructive feedback addressing these areas. Keep the critique concise but specific, highlighting the most critical improvements needed. Avoid unnecessary elaboration or repetition."
+)
+
+# Appended after the single-topic prompts above so bulk calls share their prefix
+BULK_TOPICS_INSTRUCTION = (
+    "The user gives several topics from the study plan instead of one. "
+    "Answer every topic independently, exactly as you would if it were the only topic. "
+    "Respond with a JSON object whose keys are the topics exactly as given and whose values are the answers as plain text."
+)
+
+
+def info_messages(info_message):
+    return [
+        {"role": "system", "content": INFO_SYSTEM_PROMPT},
+        {"role": "user", "content": info_message}
+    ]
+
+def plan_reasoning_messages(study_plan, study_plan_overview_str):
+    return [
+        {"role": "system", "content": PLAN_REASONING_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Study plan:\n{json.dumps(study_plan)}\n\nStudy plan overview:\n{study_plan_overview_str}"}
+    ]
+
+def topic_explanation_messages(topic, recent_plan):
+    return [
+        {"role": "system", "content": TOPIC_EXPLANATION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Study plan: '{recent_plan}'\n\nTopic: '{topic}'"}
+    ]
+
+def objectives_messages(topic, recent_plan):
+    return [
+        {"role": "system", "content": OBJECTIVES_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Study plan: '{recent_plan}'\n\nTopic: '{topic}'"}
+    ]
+
+def topic_explanations_bulk_messages(topics, recent_plan):
+    return [
+        {"role": "system", "content": TOPIC_EXPLANATION_SYSTEM_PROMPT},
+        {"role": "system", "content": BULK_TOPICS_INSTRUCTION},
+        {"role": "user", "content": f"Study plan: '{recent_plan}'\n\nTopics: {json.dumps(topics)}"}
+    ]
+
+def objectives_bulk_messages(topics, recent_plan):
+    return [
+        {"role": "system", "content": OBJECTIVES_SYSTEM_PROMPT},
+        {"role": "system", "content": BULK_TOPICS_INSTRUCTION},
+        {"role": "user", "content": f"Study plan: '{recent_plan}'\n\nTopics: {json.dumps(topics)}"}
+    ]
+
+def critique_messages(parsed_json):
+    return [
+        {"role": "system", "content": CRITIQUE_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Here's my initial study plan response: {plan_text(parsed_json)}."}
+    ]
@@ -0,0 +1,138 @@
+# Response_cache.py
+# Content-addressed cache of LLM completions for deterministic calls.
+# The key is a hash of the model, the sampling parameters and the normalized
+# messages, so identical temperature-0 requests from different participants
+# share one OpenAI call. Tier 1 is an in-process LRU; tier 2 is the Firestore
+# "llm_cache" collection, shared across workers and cold starts.
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from components.Clients import LazyCollection
+from components.Cache import LRUCache
+from components.Metrics import span
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+RESPONSE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+
+def normalize_messages(messages):
+    # Whitespace-only differences (indentation of inline prompts, trailing newlines) must not miss
+    return [
+        {"role": message.get("role"), "content": re.sub(r"\s+", " ", message["content"]).strip() if isinstance(message.get("content"), str) else message.get("content")}
+        for message in messages
+    ]
+
+
+class ResponseCache:
+    def __init__(self, collection="llm_cache", maxsize=2000, ttl=RESPONSE_TTL):
+        self.collection_name = collection
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.persistent_hits = 0
+        self.persistent_misses = 0
+        self.collection = LazyCollection(collection)
+        self._inflight = {}
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        payload = json.dumps({"model": model, "messages": normalize_messages(messages), **params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _read_persistent(self, key):
+        collection = self.collection.get()
+        if collection is None:
+            return None
+        try:
+            with span(f"firestore.{self.collection_name}.get"):
+                doc = collection.document(key).get()
+            if doc.exists:
+                data = doc.to_dict()
+                remaining = data.get("expires", 0) - time.time()
+                if remaining > 0:
+                    self.persistent_hits += 1
+                    self.memory.set(key, data["text"], ttl=remaining)
+                    return data["text"]
+        except Exception as e:
+            logger.warning(f"Error reading LLM cache: {e}")
+        self.persistent_misses += 1
+        return None
+
+    def _write_persistent(self, key, text, model):
+        collection = self.collection.get()
+        if collection is None:
+            return
+        try:
+            with span(f"firestore.{self.collection_name}.set"):
+                collection.document(key).set({
+                    "text": text,
+                    "model": model,
+                    "expires": time.time() + self.ttl
+                })
+        except Exception as e:
+            logger.warning(f"Error writing LLM cache: {e}")
+
+    async def get(self, key):
+        text = self.memory.get(key)
+        if text is not None:
+            return text
+        return await asyncio.to_thread(self._read_persistent, key)
+
+    async def set(self, key, text, model=None):
+        if not text:
+            return
+        self.memory.set(key, text)
+        await asyncio.to_thread(self._write_persistent, key, text, model)
+
+    async def get_or_complete(self, key, complete, model=None):
+        """Return the cached text for `key`, awaiting complete() at most once across concurrent callers."""
+        text = await self.get(key)
+        if text is not None:
+            return text
+
+        while key in self._inflight:
+            pending = self._inflight[key]
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # `pending` is only cancelled when its owner was; then this caller takes over
+                if not pending.cancelled():
+                    raise
+
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            text = await complete()
+            await self.set(key, text, model=model)
+            pending.set_result(text)
+            return text
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters get the exception; keep it from being reported as never retrieved
+            pending.exception()
+            raise
+        except BaseException:
+            # Cancelled (e.g. the client disconnected): release the waiters too
+            pending.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        stats = self.memory.stats()
+        lookups = self.persistent_hits + self.persistent_misses
+        stats["persistent_hits"] = self.persistent_hits
+        stats["persistent_misses"] = self.persistent_misses
+        stats["persistent_hit_rate"] = round(self.persistent_hits / lookups, 4) if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache()
+# Week reasoning for /plan-reasoning, keyed by the hash of the plan version it explains
+plan_reasoning_cache = ResponseCache(collection="plan_reasoning")
+# Per-topic explanations and objectives, keyed by kind, plan version and topic
+topic_cache = ResponseCache(collection="topic_details", maxsize=10000)
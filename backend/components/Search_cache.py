@@ -0,0 +1,117 @@
+# Search_cache.py
+# Normalized-query cache for YouTube search.list results (100 quota units each).
+# Results are kept in an in-process LRU and in the Firestore "search_cache"
+# collection so identical queries from different participants, workers and
+# retries share one API call. Concurrent identical lookups wait for the call
+# already in flight instead of issuing their own.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from components.Clients import LazyCollection
+from components.Cache import LRUCache
+from components.Metrics import span
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+SEARCH_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+INFLIGHT_WAIT_SECONDS = 30
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", (query or "").strip().lower())
+
+
+class _Pending:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class SearchCache:
+    def __init__(self, collection="search_cache", maxsize=2000, ttl=SEARCH_TTL):
+        self.collection_name = collection
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.collection = LazyCollection(collection)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query, **params):
+        return json.dumps({"q": normalize_query(query), **params}, sort_keys=True)
+
+    @staticmethod
+    def _doc_id(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _read(self, key):
+        result = self.memory.get(key)
+        if result is not None:
+            return result
+        collection = self.collection.get()
+        if collection is None:
+            return None
+        try:
+            with span(f"firestore.{self.collection_name}.get"):
+                doc = collection.document(self._doc_id(key)).get()
+            if doc.exists:
+                data = doc.to_dict()
+                remaining = data.get("expires", 0) - time.time()
+                if remaining > 0:
+                    result = json.loads(data["result"])
+                    self.memory.set(key, result, ttl=remaining)
+                    return result
+        except Exception as e:
+            logger.warning(f"Error reading search cache: {e}")
+        return None
+
+    def _write(self, key, result):
+        self.memory.set(key, result)
+        collection = self.collection.get()
+        if collection is None:
+            return
+        try:
+            with span(f"firestore.{self.collection_name}.set"):
+                collection.document(self._doc_id(key)).set({
+                    "key": key,
+                    "result": json.dumps(result),
+                    "expires": time.time() + self.ttl
+                })
+        except Exception as e:
+            logger.warning(f"Error writing search cache: {e}")
+
+    def get_or_fetch(self, key, fetch):
+        """Return the cached result for `key`, calling fetch() at most once across concurrent callers."""
+        result = self._read(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = _Pending()
+
+        if not owner:
+            pending.event.wait(INFLIGHT_WAIT_SECONDS)
+            if pending.result is not None:
+                return pending.result
+            return fetch()
+
+        try:
+            result = fetch()
+            if result is not None:
+                self._write(key, result)
+            pending.result = result
+            return result
+        finally:
+            pending.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+search_cache = SearchCache()
@@ -0,0 +1,74 @@
+# Study_plan.py
+# The study plan schema, defined once, and the single place plan text is parsed.
+# Plan-producing calls ask the API for JSON mode, so the text is a bare JSON object;
+# fenced ```json blocks from free-form replies (chat_response) are still accepted.
+# Parsed plans are validated against StudyPlan and passed on as plain dicts, in
+# the same shape the frontend already reads. The model coerces the loose shapes
+# models sometimes produce (a numeric Time, a single YouTube object, list-valued
+# overviews); anything else with a `studyPlan` mapping is still returned as is,
+# so video validation never skips a plan the frontend can render.
+import json
+import re
+from typing import Any, Dict, List, Union
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+# Strict json_schema structured outputs need fixed keys; week names are free-form, so JSON mode it is
+PLAN_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+class YouTubeResource(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    title: str = ""
+    link: str = ""
+
+
+class Resources(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    YouTube: List[YouTubeResource] = []
+
+    @field_validator("YouTube", mode="before")
+    @classmethod
+    def wrap_single_video(cls, value):
+        return [value] if isinstance(value, dict) else value
+
+
+class StudyDay(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    day: str = ""
+    topic: str = ""
+    Time: Union[str, int, float] = ""
+    resources: Resources = Resources()
+
+
+class StudyPlan(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    studyPlan_Overview: Dict[str, Any] = {}
+    studyPlan: Dict[str, List[StudyDay]]
+
+
+def parse_study_plan(value):
+    """Return the plan as a validated dict, or None if `value` does not hold a study plan."""
+    if isinstance(value, StudyPlan):
+        return value.model_dump(exclude_unset=True)
+    if isinstance(value, str):
+        text = value.strip()
+        json_match = re.search(r'```json([\s\S]*?)```', text)
+        if json_match:
+            text = json_match.group(1).strip()
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(value, dict):
+        return None
+    try:
+        return StudyPlan.model_validate(value).model_dump(exclude_unset=True)
+    except ValidationError:
+        return value if isinstance(value.get("studyPlan"), dict) else None
+
+
+def plan_text(plan):
+    # Compact JSON for prompts; raw text (an unparseable reply) is passed through as is
+    if isinstance(plan, str):
+        return plan
+    return json.dumps(plan, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,97 @@
+# Video_cache.py
+# Two-tier cache of YouTube video metadata keyed by video ID.
+# Tier 1 is an in-process LRU; tier 2 is the Firestore "video_cache" collection,
+# shared across workers and cold starts. Snippets (which also answer "does this
+# video exist?") and statistics are cached separately with their own TTLs.
+import os
+import time
+from components.Clients import LazyCollection, get_firestore
+from components.Cache import LRUCache
+from components.Metrics import span
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
+
+SNIPPET_TTL = int(os.getenv("VIDEO_SNIPPET_TTL", str(7 * 24 * 3600)))
+STATISTICS_TTL = int(os.getenv("VIDEO_STATISTICS_TTL", str(6 * 3600)))
+# Videos reported missing are re-checked sooner, in case of a transient API answer
+NOT_FOUND_TTL = 24 * 3600
+PART_TTLS = {"snippet": SNIPPET_TTL, "statistics": STATISTICS_TTL}
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class VideoMetadataCache:
+    def __init__(self, collection="video_cache", maxsize=5000):
+        self.collection_name = collection
+        self.memory = LRUCache(maxsize=maxsize)
+        self.collection = LazyCollection(collection)
+
+    @staticmethod
+    def _ttl(part, record):
+        return PART_TTLS[part] if record.get("exists") else min(PART_TTLS[part], NOT_FOUND_TTL)
+
+    def get_many(self, video_ids, part):
+        """Return {video_id: record} for every ID cached and fresh in either tier.
+
+        A record is {"exists": bool, "data": dict}.
+        """
+        found = {}
+        missing = []
+        for video_id in dict.fromkeys(video_ids):
+            record = self.memory.get((video_id, part))
+            if record is not None:
+                found[video_id] = record
+            else:
+                missing.append(video_id)
+
+        collection = self.collection.get()
+        if not missing or collection is None:
+            return found
+        try:
+            now = time.time()
+            refs = [collection.document(video_id) for video_id in missing]
+            with span(f"firestore.{self.collection_name}.get_all"):
+                docs = list(get_firestore().get_all(refs, field_paths=[part, f"{part}_expires"]))
+            for doc in docs:
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                expires_at = data.get(f"{part}_expires", 0)
+                if part in data and expires_at > now:
+                    found[doc.id] = data[part]
+                    self.memory.set((doc.id, part), data[part], ttl=expires_at - now)
+        except Exception as e:
+            logger.warning(f"Error reading video cache: {e}")
+        return found
+
+    def get(self, video_id, part):
+        return self.get_many([video_id], part).get(video_id)
+
+    def set_many(self, records, part):
+        """Store {video_id: record} in both tiers."""
+        now = time.time()
+        for video_id, record in records.items():
+            self.memory.set((video_id, part), record, ttl=self._ttl(part, record))
+
+        collection = self.collection.get()
+        if not records or collection is None:
+            return
+        try:
+            items = list(records.items())
+            for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                batch = get_firestore().batch()
+                for video_id, record in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                    batch.set(collection.document(video_id), {
+                        part: record,
+                        f"{part}_expires": now + self._ttl(part, record)
+                    }, merge=True)
+                with span(f"firestore.{self.collection_name}.set"):
+                    batch.commit()
+        except Exception as e:
+            logger.warning(f"Error writing video cache: {e}")
+
+    def set(self, video_id, part, record):
+        self.set_many({video_id: record}, part)
+
+
+video_cache = VideoMetadataCache()
@@ -3,7 +3,6 @@
 # Input: subject from previous stage
 # Output: videoId, title, description, thumbnails, channelTitle, publishtime
 import json
-from googleapiclient.discovery import build
 import os
 import re
 import random
@@ -16,8 +15,18 @@ env_vars_dict = dict(env_vars)
 youtube_api_keys = [k for k in env_vars_dict if k.startswith("YOUTUBE_API_KEY")]
 '''
 from dotenv import load_dotenv
+from googleapiclient.errors import HttpError
+from components.HTTP_client import get_google_client
+from components.API_key_pool import APIKeyPool, QUOTA_COST, error_reason
+from components.Video_cache import video_cache
+from components.Search_cache import SearchCache, search_cache
+from components.Metrics import span
+from components.Logger import get_logger
+
+logger = get_logger(__name__)
 load_dotenv()
 youtube_api_keys = [k for k in os.environ if k.startswith("YOUTUBE_API_KEY")]
+key_pool = APIKeyPool.from_env()
 
 def get_random_api_key():
     """Retrieve a random YouTube API key from the environment variables."""
@@ -30,44 +39,68 @@ def get_random_api_key():
     else:
         raise ValueError("No YOUTUBE_API_KEY found in environment variables.")
 
-def get_youtube_client():
-    """Create and return a YouTube API client using a random API key."""
-    while youtube_api_keys:
+def execute_youtube(make_request, method="videos.list"):
+    """Run make_request(youtube).execute() with a pooled key, rotating to another key when the key is exhausted or rate limited."""
+    units = QUOTA_COST.get(method, 1)
+    for _ in range(max(len(key_pool), 1)):
+        key_name, api_key = key_pool.acquire(units)
+        youtube = get_google_client('youtube', 'v3', api_key)
         try:
-            selected_key = random.choice(youtube_api_keys)
-            api_key = os.getenv(selected_key)
-            youtube = build('youtube', 'v3', developerKey=api_key)
-            # Test the key with a simple request to check if it has quota
-            youtube.videos().list(part="snippet", id="Ks-_Mh1QhMc").execute()
-            return youtube
-        except Exception as e:
-            print(f"API key {selected_key} quota exceeded or invalid, trying another. Error: {e}")
-            youtube_api_keys.remove(selected_key)
+            with span(f"youtube.{method}"):
+                return make_request(youtube).execute()
+        except HttpError as e:
+            # Errors that are not about the key (e.g. a bad pageToken) would fail with any key
+            if not key_pool.report_failure(key_name, e.resp.status, error_reason(e.content)):
+                raise
+            logger.warning(f"API key {key_name} quota exceeded or invalid, trying another. Error: {e}")
     raise ValueError("All API keys have exceeded quota or are invalid.")
 
+# videos.list accepts up to 50 comma-separated IDs per call
+VIDEO_BATCH_SIZE = 50
+
+def get_video_records(video_ids, part="snippet"):
+    """Return {video_id: {"exists": bool, "data": dict}}, served from the cache where possible."""
+    records = video_cache.get_many(video_ids, part)
+    missing = [video_id for video_id in dict.fromkeys(video_ids) if video_id not in records]
+    for start in range(0, len(missing), VIDEO_BATCH_SIZE):
+        batch = missing[start:start + VIDEO_BATCH_SIZE]
+        response = execute_youtube(lambda youtube: youtube.videos().list(
+            part=part,
+            id=",".join(batch),
+            maxResults=VIDEO_BATCH_SIZE
+        ))
+        fetched = {video_id: {"exists": False, "data": {}} for video_id in batch}
+        for item in response.get('items', []):
+            fetched[item['id']] = {"exists": True, "data": item.get(part, {})}
+        video_cache.set_many(fetched, part)
+        records.update(fetched)
+    return records
+
 def get_search_response(query):
-    youtube = get_youtube_client()  # Initialize YouTube client
     max_duration_seconds = extract_available_time(query)
     if max_duration_seconds is None:
-        print("Not available time")
+        logger.debug("Not available time")
         return []
-    print(max_duration_seconds)
+    logger.debug(f"Max duration: {max_duration_seconds}s")
     if max_duration_seconds <= 240:  
         video_duration = "short"
     elif max_duration_seconds <= 1200:  
         video_duration = "medium"
     else:
         video_duration = "long"
-    print(query)
-    search_response = youtube.search().list(
-        q=query,
-        order="relevance",
-        part="snippet",
-        type="video",
-        regionCode="US",
-        maxResults=10,
-        safeSearch="strict"
-    ).execute()
+    logger.debug(f"Search query: {query}")
+    search_response = search_cache.get_or_fetch(
+        SearchCache.make_key(query, order="relevance", maxResults=10),
+        lambda: execute_youtube(lambda youtube: youtube.search().list(
+            q=query,
+            order="relevance",
+            part="snippet",
+            type="video",
+            regionCode="US",
+            maxResults=10,
+            safeSearch="strict"
+        ), method="search.list")
+    )
 
     return search_response
 
@@ -122,37 +155,40 @@ def extract_video_id(url):
         raise ValueError("Invalid YouTube URL")
 
 def get_video_thumbnail(video_id):
-    youtube = get_youtube_client()  # Initialize YouTube client
-    video_response = youtube.videos().list(
-        part="snippet",
-        id=video_id
-    ).execute()
-
-    if 'items' in video_response and len(video_response['items']) > 0:
-        video_details = video_response['items'][0]['snippet']
+    record = get_video_records([video_id], "snippet")[video_id]
+
+    if record["exists"]:
+        video_details = record["data"]
         thumbnail_url = video_details.get('thumbnails', {}).get('high', {}).get('url', 'No Thumbnail')
         return thumbnail_url
     else:
-        print(f"No thumbnail found for ID: {video_id}")
+        logger.debug(f"No thumbnail found for ID: {video_id}")
         return 'https://via.placeholder.com/120'
 
-def search_similar_videos(query):
-    youtube = get_youtube_client()  # Initialize YouTube client
-    print("search_similar_videos", query)
-    try:
-        search_response = youtube.search().list(
+# Candidates fetched per similar-video query; retries consume these instead of re-searching
+SIMILAR_VIDEO_CANDIDATES = 5
+
+def search_similar_candidates(query):
+    """Return the ranked search items for `query`, from the shared search cache when possible."""
+    search_response = search_cache.get_or_fetch(
+        SearchCache.make_key(query, order="rating", maxResults=SIMILAR_VIDEO_CANDIDATES),
+        lambda: execute_youtube(lambda youtube: youtube.search().list(
             q=query,
             order="rating",
             part="snippet",
             type="video",
             regionCode="US",
-            maxResults=1,
+            maxResults=SIMILAR_VIDEO_CANDIDATES,
             safeSearch="strict"
-        ).execute()
-
-        print("items", search_response['items'])
+        ), method="search.list")
+    )
+    return search_response.get('items', [])
 
-        items = search_response.get('items', [])
+def search_similar_videos(query):
+    """Return the best-ranked video for `query`."""
+    logger.debug(f"search_similar_videos: {query}")
+    try:
+        items = search_similar_candidates(query)
         if not items:
             return {
                 'exists': False,
@@ -160,8 +196,9 @@ def search_similar_videos(query):
             }
 
         # Process the first video in the items list
-        video_details = items[0]['snippet']
-        video_id = items[0]['id'].get('videoId', 'No Video ID')
+        item = items[0]
+        video_details = item['snippet']
+        video_id = item['id'].get('videoId', 'No Video ID')
         if not video_id:
             return {
                 'exists': False,
@@ -187,7 +224,6 @@ def search_similar_videos(query):
         return {"exists": False, "message": f"An error occurred during search: {e}"}
 
 def check_resource_availability(url, query):
-    youtube = get_youtube_client()  # Initialize YouTube client
     try:
         video_id = extract_video_id(url)
         if not video_id or len(video_id) != 11:
@@ -195,14 +231,11 @@ def check_resource_availability(url, query):
                 "exists": False,
                 "message": f"Invalid video ID extracted from URL: {url}"
             }
-        print("Check_resoure_availailbity in YouTube_request.py: ",video_id)
-        video_response = youtube.videos().list(
-            part="snippet",
-            id=video_id
-        ).execute()
+        logger.debug(f"check_resource_availability: {video_id}")
+        record = get_video_records([video_id], "snippet")[video_id]
 
-        if 'items' in video_response and len(video_response['items']) > 0:
-            video_details = video_response['items'][0]['snippet']
+        if record["exists"]:
+            video_details = record["data"]
             thumbnail_url = video_details.get('thumbnails', {}).get('high', {}).get('url', 'No Thumbnail')
             title = video_details.get('title', 'No Title')
             description = video_details.get('description', 'No Description')
@@ -229,15 +262,10 @@ def check_resource_availability(url, query):
         }
 
 def get_video_stats(video_id):
-    youtube = get_youtube_client()  # Initialize YouTube client
-    request = youtube.videos().list(
-        part="statistics",
-        id=video_id
-    )
-    response = request.execute()
+    record = get_video_records([video_id], "statistics")[video_id]
     
-    if "items" in response and len(response["items"]) > 0:
-        stats = response["items"][0]["statistics"]
+    if record["exists"]:
+        stats = record["data"]
         view_count = stats.get("viewCount", "N/A")
         like_count = stats.get("likeCount", "N/A")
         return {"views": view_count, "likes": like_count}
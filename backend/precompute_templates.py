@@ -0,0 +1,90 @@
+# precompute_templates.py
+# Offline batch job that fills the plan template index used by /response.
+# Counts the plan requests stored on participant sessions, takes the most
+# frequent (level, topic, duration, hours) tuples, and runs each through the
+# same initial -> critique -> improved -> video validation pipeline as the app.
+#
+#   python precompute_templates.py --top 50
+#   python precompute_templates.py --requests requests.txt   # one plan request per line
+import argparse
+import asyncio
+from collections import Counter
+from app import chat_app, process_improved_response
+from components.Database import db
+from components.HTTP_client import open_session, close_session
+from components.Plan_templates import parse_plan_request, template_key, plan_templates
+from components.Study_plan import parse_study_plan
+
+TEMPLATE_PARTICIPANT = "plan-template-job"
+
+
+def frequent_requests(top):
+    # One representative message per normalized key, ordered by how often it was asked
+    counts = Counter()
+    examples = {}
+    for doc in db.collection("messages").select(["user_message"]).stream():
+        user_message = (doc.to_dict() or {}).get("user_message")
+        params = parse_plan_request(user_message)
+        if params is None:
+            continue
+        key = template_key(params)
+        counts[key] += 1
+        examples.setdefault(key, user_message)
+    return [(examples[key], count) for key, count in counts.most_common(top)]
+
+
+async def build_template(user_message):
+    participant_id = f"{TEMPLATE_PARTICIPANT}-{abs(hash(user_message))}"
+    try:
+        initial_response = await chat_app.chat(user_message, participant_id)
+        critique_response = await chat_app.get_critique_response(initial_response)
+        improved_response = await chat_app.get_improved_response(user_message, initial_response, critique_response)
+        return await process_improved_response(user_message, improved_response)
+    finally:
+        chat_app.conversations.clear(participant_id)
+
+
+async def main(args):
+    if args.requests:
+        with open(args.requests) as f:
+            requests = [(line.strip(), None) for line in f if line.strip()]
+    else:
+        requests = frequent_requests(args.top)
+
+    await open_session()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stored = 0
+
+    async def run(user_message, count):
+        nonlocal stored
+        params = parse_plan_request(user_message)
+        if params is None:
+            print(f"Skipping, not a plan request: {user_message}")
+            return
+        async with semaphore:
+            try:
+                plan = await build_template(user_message)
+            except Exception as e:
+                print(f"Failed to build template for {user_message}: {e}")
+                return
+        # Only plans that parsed and went through video validation are served
+        if parse_study_plan(plan) is None:
+            print(f"Discarding invalid plan for {user_message}")
+            return
+        await asyncio.to_thread(plan_templates.store, params, plan, user_message)
+        stored += 1
+        print(f"Stored template ({count or '-'} requests): {user_message}")
+
+    try:
+        await asyncio.gather(*(run(user_message, count) for user_message, count in requests))
+    finally:
+        await close_session()
+    print(f"Stored {stored} of {len(requests)} plan templates")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute study plan templates for frequent requests.")
+    parser.add_argument("--top", type=int, default=50, help="number of most frequent requests to precompute")
+    parser.add_argument("--requests", help="file with one plan request per line, instead of reading sessions")
+    parser.add_argument("--concurrency", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
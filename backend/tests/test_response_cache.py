@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from components.Response_cache import ResponseCache
+
+
+def memory_only_cache():
+    cache = ResponseCache()
+    cache.collection.enabled = False
+    return cache
+
+
+def test_concurrent_callers_share_one_completion():
+    cache = memory_only_cache()
+    calls = []
+
+    async def complete():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_complete("key", complete) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+
+
+def test_waiter_takes_over_when_owner_is_cancelled():
+    cache = memory_only_cache()
+    calls = []
+
+    async def complete():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        owner = asyncio.create_task(cache.get_or_complete("key", complete))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_complete("key", complete))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        text = await asyncio.wait_for(waiter, timeout=1)
+        return text
+
+    assert asyncio.run(main()) == "answer"
+    assert len(calls) == 2
+    assert cache._inflight == {}
+
+
+def test_cancelled_waiter_leaves_owner_running():
+    cache = memory_only_cache()
+
+    async def complete():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        owner = asyncio.create_task(cache.get_or_complete("key", complete))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_complete("key", complete))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(main()) == "answer"
+    assert cache._inflight == {}
+
+
+def test_owner_exception_reaches_waiters_and_releases_key():
+    cache = memory_only_cache()
+
+    async def complete():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_complete("key", complete) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache._inflight == {}